@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+The one bit of the edX user model the block relies on that plain Django doesn't have.
+"""
+
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class UserProfile(models.Model):
+    user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255, blank=True)
+
+    class Meta(object):
+        app_label = 'benchmarks'
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the masterclass handlers, over rosters of different sizes.
+
+Run from the repository root, with XBlock and Django installed:
+
+    python -m benchmarks.run --sizes 10 100 1000 10000 --output benchmarks.json
+
+Everything runs against the stand-in runtime in runtime.py, a SQLite database and the locmem email backend.
+Results go to the JSON file, one entry per benchmark and roster size, so that runs on different commits
+can be compared.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core import mail  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings  # noqa: E402
+
+from benchmarks.models import UserProfile  # noqa: E402
+from benchmarks.runtime import BlockHarness, COURSE_ID, CourseEmailTemplate, install_stand_ins  # noqa: E402
+from masterclass import caching, course_index, registrations, resources, tasks  # noqa: E402
+from masterclass.emails import MessageBuilder  # noqa: E402
+from masterclass.masterclass import MasterclassXBlock  # noqa: E402
+from masterclass.packing import pack  # noqa: E402
+from masterclass.registrations import APPROVED, STATES, WAITLISTED  # noqa: E402
+from masterclass.users import fetch_users  # noqa: E402
+
+STAFF_ID = 1
+
+# How many master-class blocks the course-wide benchmarks spread the students over.
+COURSE_BLOCKS = 20
+
+# Every roster gets a block of its own, so that nothing cached for one is served for another.
+_roster_numbers = itertools.count()
+
+
+def create_database(size):
+    """A fresh database with `size` students, whose IDs are 2 to size + 1, and a staff user with ID 1."""
+    connection.close()
+    if os.path.exists(settings.DATABASES['default']['NAME']):
+        os.remove(settings.DATABASES['default']['NAME'])
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    # The process would otherwise go on taking the blocks of the previous database for seeded.
+    registrations._seeded.clear()
+    users = [User(id=user_id, username=u"user{0}".format(user_id), email=u"user{0}@example.com".format(user_id))
+             for user_id in range(1, size + 2)]
+    User.objects.bulk_create(users, batch_size=500)
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user.id, name=u"Слушатель Номер{0}".format(user.id)) for user in users], batch_size=500)
+    return list(range(2, size + 2))
+
+
+def clear_caches():
+    """Forget everything in the Django cache and the process cache, so that the next call finds nothing there."""
+    cache.clear()
+    with caching._process_lock:
+        caching._process_values.clear()
+
+
+def measure(function, repeat, before=None):
+    """
+    The best wall time of `repeat` calls of `function`, and the number of queries one call made.
+    `before`, if given, is called before each of them, and isn't timed.
+    """
+    best = None
+    queries = 0
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            function()
+            elapsed = time.time() - start
+        queries = len(context.captured_queries)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, queries
+
+
+def result(name, size, seconds, queries=None, operations=1, **extra):
+    entry = {
+        'benchmark': name,
+        'size': size,
+        'seconds': seconds,
+        'per_second': operations / seconds if seconds else None,
+        'queries': queries,
+    }
+    entry.update(extra)
+    return entry
+
+
+def measure_cold_and_warm(name, students, function, repeat):
+    """
+    Results of `function` with nothing cached, and then with whatever it caches already there,
+    as "<name>_cold" and "<name>_warm".
+    """
+    seconds, queries = measure(function, repeat, before=clear_caches)
+    yield result(name + '_cold', len(students), seconds, queries)
+    function()
+    seconds, queries = measure(function, repeat)
+    yield result(name + '_warm', len(students), seconds, queries)
+
+
+def roster_harness(students, **settings):
+    settings.setdefault('name', u"roster{0}".format(next(_roster_numbers)))
+    harness = BlockHarness(capacity=len(students) + 1, **settings)
+    block = harness.block(STAFF_ID, role='staff')
+    block.packed_registrations = pack({APPROVED: students})
+    block.save()
+    return harness
+
+
+def bench_student_view(students, repeat):
+    harness = roster_harness(students)
+    for entry in measure_cold_and_warm('student_view_staff', students,
+                                       lambda: harness.view(STAFF_ID, role='staff'), repeat):
+        yield entry
+    for entry in measure_cold_and_warm('roster_first_page', students,
+                                       lambda: harness.handle(STAFF_ID, 'roster', {'state': APPROVED, 'page': 1},
+                                                              role='staff'), repeat):
+        yield entry
+
+
+def bench_get_csv(students, repeat):
+    harness = roster_harness(students)
+
+    def export():
+        response = harness.handle(STAFF_ID, 'get_csv', method='GET', role='staff')
+        return sum(len(chunk) for chunk in response.app_iter)
+
+    seconds, queries = measure(export, repeat)
+    yield result('get_csv', len(students), seconds, queries, operations=len(students), bytes=export())
+
+
+def bench_send_mail_to_all(students, repeat):
+    harness = roster_harness(students)
+
+    def send():
+        mail.outbox = []
+        response = harness.handle(STAFF_ID, 'send_mail_to_all', {'subject': u"Тема", 'text': u"Текст"}, role='staff')
+        job_id = json.loads(response.body.decode('utf8'))['job_id']
+        while not tasks.job_progress(job_id)['done']:
+            time.sleep(0.01)
+        return len(mail.outbox)
+
+    seconds, queries = measure(send, repeat)
+    yield result('send_mail_to_all', len(students), seconds, queries, operations=len(students), sent=send())
+
+
+def bench_email_compose(students, repeat):
+    """The message builder against rendering the template for every recipient, as it used to be done."""
+    users = list(fetch_users(students).values())
+
+    def per_recipient():
+        template = CourseEmailTemplate.get_template()
+        context = {'course_title': u"Курс для замеров", 'course_url': u"http://localhost/"}
+        messages = []
+        for user in users:
+            context['email'] = user.email
+            context['name'] = user.profile.name
+            message = mail.EmailMultiAlternatives(u"Тема", template.render_plaintext(u"Текст", context),
+                                                  u"noreply@localhost", [user.email])
+            message.attach_alternative(template.render_htmltext(u"Текст", context), 'text/html')
+            messages.append(message)
+        return messages
+
+    def builder():
+        message_builder = MessageBuilder(COURSE_ID, u"Тема", u"Текст")
+        return [message_builder.message(user) for user in users]
+
+    seconds, queries = measure(per_recipient, repeat)
+    yield result('email_compose_per_recipient', len(students), seconds, queries, operations=len(students))
+    seconds, queries = measure(builder, repeat)
+    yield result('email_compose_builder', len(students), seconds, queries, operations=len(students))
+
+
+def bench_register_concurrently(students, repeat, workers):
+    """
+    Everyone clicks register at once, on the database backend, with half as many places as students.
+    Counts registrations that got lost, and places sold beyond capacity, both of which should be zero.
+    """
+    capacity = max(len(students) // 2, 1)
+    with override_settings(MASTERCLASS_REGISTRATION_BACKEND='database'):
+        harness = BlockHarness(name=u"concurrent", capacity=capacity)
+
+        def register(student):
+            try:
+                harness.handle(student, 'register_button', {'button_clicked': "True"})
+            finally:
+                connection.close()
+
+        pool = ThreadPool(workers)
+        start = time.time()
+        pool.map(register, students)
+        seconds = time.time() - start
+        pool.close()
+
+        registrations = harness.block(STAFF_ID, role='staff').registrations
+        approved = registrations.count(APPROVED)
+        waitlisted = registrations.count(WAITLISTED)
+    yield result('register_button_concurrent', len(students), seconds, operations=len(students), workers=workers,
+                 approved=approved, waitlisted=waitlisted, lost=len(students) - approved - waitlisted,
+                 overbooked=max(approved - capacity, 0))
+
+
+def bench_course_index(students, repeat):
+    """
+    Seat usage of every block of a course, and one student's registrations across it, from the course index,
+    against loading every block, which is what it takes without it. The stand-in runtime keeps block fields
+    in memory, so loading a block costs less here than in the LMS, where it's a query of its own.
+    Then everyone registering at once on one block, with the index kept up to date.
+    """
+    with override_settings(MASTERCLASS_COURSE_INDEX=True):
+        harnesses = []
+        for number in range(COURSE_BLOCKS):
+            harness = roster_harness(students[number::COURSE_BLOCKS])
+            harness.block(STAFF_ID, role='staff').course_index().rebuild()
+            harnesses.append(harness)
+        student = students[-1]
+
+        def summaries_by_loading():
+            blocks = [harness.block(STAFF_ID, role='staff') for harness in harnesses]
+            return [dict((state, block.registrations.count(state)) for state in STATES) for block in blocks]
+
+        def student_by_loading():
+            blocks = [harness.block(STAFF_ID, role='staff') for harness in harnesses]
+            return [block.registrations.state_of(student) for block in blocks]
+
+        for name, function in (
+                ('course_summaries_loading_blocks', summaries_by_loading),
+                ('course_summaries_index', lambda: course_index.block_summaries(COURSE_ID)),
+                ('course_student_loading_blocks', student_by_loading),
+                ('course_student_index', lambda: course_index.student_registrations(COURSE_ID, student))):
+            seconds, queries = measure(function, repeat)
+            yield result(name, len(students), seconds, queries, blocks=COURSE_BLOCKS)
+
+        def register_everyone():
+            harness = BlockHarness(name=u"roster{0}".format(next(_roster_numbers)), capacity=len(students))
+            block = harness.block(STAFF_ID, role='staff')
+            block.registrations.transition_many(students, APPROVED, capacity=len(students))
+            block.save()
+
+        seconds, queries = measure(register_everyone, repeat)
+        yield result('course_index_bulk_register', len(students), seconds, queries, operations=len(students))
+
+
+def bench_template_render(students, repeat):
+    """Rendering the student template from the process-wide cache, against reading and compiling it every time."""
+    path = "static/html/masterclass.html"
+    context = {'display_name': u"Мастер-класс", 'capacity': 30, 'free': 10}
+
+    def uncached():
+        return MasterclassXBlock.render_template_from_string(resources._load_resource(path), **context)
+
+    def cached():
+        return MasterclassXBlock.render_template(path, **context)
+
+    for name, function in (('template_render_uncached', uncached), ('template_render_cached', cached)):
+        seconds, queries = measure(lambda: [function() for _ in range(100)], repeat)
+        yield result(name, len(students), seconds, queries, operations=100)
+
+
+BENCHMARKS = (
+    bench_student_view,
+    bench_get_csv,
+    bench_send_mail_to_all,
+    bench_email_compose,
+    bench_course_index,
+    bench_template_render,
+)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each benchmark, the best one counts")
+    parser.add_argument('--workers', type=int, default=16, help="threads clicking register at once")
+    parser.add_argument('--output', default='benchmarks.json')
+    args = parser.parse_args(argv)
+
+    install_stand_ins()
+    results = []
+    for size in args.sizes:
+        students = create_database(size)
+        runs = [benchmark(students, args.repeat) for benchmark in BENCHMARKS]
+        runs.append(bench_register_concurrently(students, args.repeat, args.workers))
+        for run in runs:
+            for entry in run:
+                results.append(entry)
+                sys.stdout.write(u"{benchmark:<32} {size:>6} {seconds:>10.4f}s\n".format(**entry))
+
+    with open(args.output, 'w') as output:
+        json.dump({
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'results': results,
+        }, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Just enough of the LMS around a MasterclassXBlock to call its views and handlers.
+
+Every `request` makes a fresh block instance over the same field storage, the way the LMS does,
+and the bits of edX the block reaches into (courses, the email template, the modulestore)
+are replaced with minimal stand-ins.
+"""
+
+import json
+
+from webob import Request
+from xblock.fields import ScopeIds
+from xblock.reference.user_service import UserService, XBlockUser
+from xblock.runtime import DictKeyValueStore, KvsFieldData, MemoryIdManager, Runtime
+
+from masterclass import emails, masterclass
+from masterclass.masterclass import MasterclassXBlock
+
+COURSE_ID = u"course-v1:Benchmark+MC101+2016"
+
+
+class Named(object):
+    def __init__(self, display_name):
+        self.display_name_with_default = display_name
+
+
+class CourseData(object):
+    """Stands in for courseware.courses."""
+
+    @staticmethod
+    def get_course(course_id):
+        return Named(u"Курс для замеров")
+
+
+class CourseEmailTemplate(object):
+    """Stands in for bulk_email.models.CourseEmailTemplate, formatting the context into the message the same way."""
+
+    PLAINTEXT = u"{name}, здравствуйте!\n\n{{message_body}}\n\n{course_title}\n{email}"
+    HTML = u"<p>{name}, здравствуйте!</p><div>{{message_body}}</div><p>{course_title}</p><p>{email}</p>"
+
+    @classmethod
+    def get_template(cls):
+        return cls()
+
+    @staticmethod
+    def _render(format_string, message_body, context):
+        return format_string.format(**context).replace(u"{message_body}", message_body)
+
+    def render_plaintext(self, plaintext, context=None):
+        return self._render(self.PLAINTEXT, plaintext, context)
+
+    def render_htmltext(self, htmltext, context=None):
+        return self._render(self.HTML, htmltext, context)
+
+
+def get_email_context(course):
+    return {'course_title': course.display_name_with_default, 'course_url': u"http://localhost/"}
+
+
+def get_source_address(course_id, course_title):
+    return u"{0} <noreply@localhost>".format(course_title)
+
+
+def install_stand_ins():
+    """Put the stand-ins where the block expects to find edX."""
+    masterclass.CourseData = CourseData
+    emails.CourseData = CourseData
+    emails.CourseEmailTemplate = CourseEmailTemplate
+    emails.get_email_context = get_email_context
+    emails.get_source_address = get_source_address
+
+
+class CurrentUserService(UserService):
+    def __init__(self, user_id):
+        super(CurrentUserService, self).__init__()
+        self.user_id = user_id
+
+    def get_current_user(self):
+        user = XBlockUser(is_current_user=True)
+        user.opt_attrs['edx-platform.user_id'] = self.user_id
+        return user
+
+
+class ModuleSystem(object):
+    """Stands in for the xmodule runtime the block looks at for roles and parents."""
+
+    def __init__(self, role):
+        self.role = role
+
+    def get_user_role(self):
+        return self.role
+
+    def get_module(self, block):
+        return block
+
+
+class Modulestore(object):
+    @staticmethod
+    def get_parent_location(location):
+        return u"parent"
+
+
+class BenchmarkRuntime(Runtime):
+
+    modulestore = Modulestore()
+
+    def handler_url(self, block, handler_name, suffix='', query='', thirdparty=False):
+        return u"/handler/{0}/{1}?{2}".format(handler_name, suffix, query)
+
+    def resource_url(self, resource):
+        return u"/resource/{0}".format(resource)
+
+    def local_resource_url(self, block, uri):
+        return u"/local/{0}".format(uri)
+
+    def publish(self, block, event_type, event_data):
+        pass
+
+    def get_block(self, usage_id, for_parent=None):
+        return Named(u"Мастер-класс для замеров")
+
+
+class BlockHarness(object):
+    """One master-class block, shared by everyone who makes requests to it, in any number of threads."""
+
+    def __init__(self, name=u"benchmark", **settings):
+        self.id_manager = MemoryIdManager()
+        self.kvs = DictKeyValueStore()
+        self.usage_id = u"block-v1:Benchmark+MC101+2016+type@masterclass+block@{0}".format(name)
+        self.settings = settings
+
+    def block(self, user_id, role='student'):
+        runtime = BenchmarkRuntime(self.id_manager, self.id_manager, services={'user': CurrentUserService(user_id)})
+        block = runtime.construct_xblock_from_class(
+            MasterclassXBlock,
+            ScopeIds(user_id, 'masterclass', self.usage_id, self.usage_id),
+            field_data=KvsFieldData(self.kvs),
+        )
+        for name, value in self.settings.items():
+            setattr(block, name, value)
+        block.course_id = COURSE_ID
+        block.location = self.usage_id
+        block.xmodule_runtime = ModuleSystem(role)
+        return block
+
+    def handle(self, user_id, handler_name, data=None, role='student', method='POST', query=''):
+        """Call a handler as `user_id`, and return the response."""
+        block = self.block(user_id, role)
+        request = Request.blank(u"/?{0}".format(query))
+        request.method = method
+        if data is not None:
+            request.body = json.dumps(data).encode('utf8')
+        return block.runtime.handle(block, handler_name, request)
+
+    def view(self, user_id, view_name='student_view', role='student'):
+        block = self.block(user_id, role)
+        return block.runtime.render(block, view_name)
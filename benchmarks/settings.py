@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Django settings for running the benchmarks outside of edX.
+"""
+
+import os
+import tempfile
+
+SECRET_KEY = 'masterclass-benchmarks'
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'masterclass_storage',
+    'benchmarks',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'benchmarks.sqlite_immediate',
+        'NAME': os.environ.get('MASTERCLASS_BENCHMARK_DB',
+                               os.path.join(tempfile.gettempdir(), 'masterclass-benchmarks.sqlite3')),
+        'OPTIONS': {'timeout': 60},
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    }
+]
+
+USE_TZ = True
+
+# Send email from the in-process thread pool, so that a benchmark can wait for it to finish.
+MASTERCLASS_EMAIL_QUEUE = 'thread'
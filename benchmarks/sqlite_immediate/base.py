@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite, but with transactions that take the write lock as soon as they begin.
+
+With plain BEGIN, two transactions that both read before they write can't both upgrade to a write lock,
+and SQLite fails one of them at once instead of making it wait. Server databases don't do that,
+so to benchmark concurrent registration the way it would behave on them, we make every transaction
+BEGIN IMMEDIATE, and let them queue up on the busy timeout.
+"""
+
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+
+class DatabaseWrapper(SQLiteDatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
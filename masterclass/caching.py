@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Caching of values that are expensive to look up, but don't change often.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .instrumentation import count
+
+# How long display names of courses and parent blocks are shared between requests, in seconds.
+# They rarely change, and when they do, a few minutes of the old name in an email subject is harmless.
+DISPLAY_NAME_TIMEOUT = 5 * 60
+
+# How many values process_cached keeps, dropping the least recently used ones beyond that.
+PROCESS_CACHE_SIZE = 32
+
+_process_values = OrderedDict()
+_process_lock = threading.Lock()
+
+
+def request_cached(method):
+    """
+    Remember what a method without arguments returned on this block instance.
+    Block instances only live as long as the request does, so this is a per-request cache.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self):
+        memo = self.__dict__.setdefault('_request_cache', {})
+        if name not in memo:
+            memo[name] = method(self)
+        return memo[name]
+    return wrapper
+
+
+def forget_request_cache(block):
+    """Drop whatever request_cached methods remembered, for when the values they depend on change."""
+    block.__dict__.pop('_request_cache', None)
+
+
+def shared(key, compute, timeout=DISPLAY_NAME_TIMEOUT, counter=None):
+    """
+    Get `key` from the Django cache, computing and storing it if it's not there.
+    With a `counter` name, hits and misses are counted as the "<counter>.hit" and "<counter>.miss" metrics.
+    """
+    value = cache.get(key)
+    if value is None:
+        if counter is not None:
+            count(u"{0}.miss".format(counter))
+        value = compute()
+        cache.set(key, value, timeout)
+    elif counter is not None:
+        count(u"{0}.hit".format(counter))
+    return value
+
+
+def process_cached(key, compute, counter=None):
+    """
+    Get `key` from a small cache in this process, computing and storing it if it's not there.
+    Meant for values too big for the Django cache, whose keys change whenever they would, such as a version.
+    The values are shared, so whoever gets one mustn't change it. `counter` is as in `shared`.
+    """
+    with _process_lock:
+        if key in _process_values:
+            _process_values[key] = value = _process_values.pop(key)
+            if counter is not None:
+                count(u"{0}.hit".format(counter))
+            return value
+    if counter is not None:
+        count(u"{0}.miss".format(counter))
+    value = compute()
+    with _process_lock:
+        _process_values[key] = value
+        while len(_process_values) > PROCESS_CACHE_SIZE:
+            _process_values.popitem(last=False)
+    return value
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+A course-wide index of master-class registrations.
+
+Every block keeps its own registrations, so answering "what is this student registered for" or
+"how full are all the sessions" would mean loading every block of the course. Instead, when
+MASTERCLASS_COURSE_INDEX is on in Django settings, every registration change is also written here,
+keyed by course and block and by course and student, and course-wide questions are answered from here.
+This needs "masterclass_storage" in INSTALLED_APPS and its migrations applied.
+
+A block that isn't in the index yet is indexed whole the first time one of its registrations changes,
+or course staff look at it. Its row may be there before that, say when its settings are saved in Studio,
+but it only counts as indexed once its registrations have been copied in whole.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils.timezone import now
+
+from .registrations import CHUNK_SIZE, STATES, Listener
+from .users import iter_users
+
+
+def enabled():
+    return getattr(settings, 'MASTERCLASS_COURSE_INDEX', False)
+
+
+def _models():
+    from masterclass_storage.models import MasterclassCourseBlock, MasterclassCourseRegistration
+    return MasterclassCourseBlock, MasterclassCourseRegistration
+
+
+class CourseIndex(Listener):
+    """
+    The index as seen by one block.
+
+    `describe` is called when the block has to be indexed whole, and should return
+    its display name, capacity, and a dict of the students in each state.
+    """
+
+    def __init__(self, course_id, block_id, describe):
+        self.course_id = course_id
+        self.block_id = block_id
+        self.describe = describe
+        self.indexed = False
+
+    def ensure_indexed(self):
+        if self.indexed:
+            return
+        block_model, registration_model = _models()
+        if not block_model.objects.filter(block_id=self.block_id, indexed=True).exists():
+            self.rebuild()
+        self.indexed = True
+
+    def rebuild(self):
+        """Replace whatever the index has for this block with what the block actually has."""
+        block_model, registration_model = _models()
+        display_name, capacity, lists = self.describe()
+        with transaction.atomic():
+            self.update_block(display_name=display_name, capacity=capacity, indexed=True)
+            registration_model.objects.filter(block_id=self.block_id).delete()
+            registration_model.objects.bulk_create(
+                registration_model(course_id=self.course_id, block_id=self.block_id, student_id=student, state=state)
+                for state, students in lists.items()
+                for student in set(students)
+            )
+
+    def update_block(self, display_name=None, capacity=None, indexed=None):
+        block_model, registration_model = _models()
+        defaults = {'course_id': self.course_id}
+        if indexed is not None:
+            defaults['indexed'] = indexed
+        if display_name is not None:
+            defaults['display_name'] = display_name
+        if capacity is not None:
+            defaults['capacity'] = capacity
+        block_model.objects.update_or_create(block_id=self.block_id, defaults=defaults)
+
+    def record(self, student, old_state, new_state):
+        self.ensure_indexed()
+        block_model, registration_model = _models()
+        if new_state is None:
+            registration_model.objects.filter(block_id=self.block_id, student_id=student).delete()
+        else:
+            registration_model.objects.update_or_create(
+                block_id=self.block_id, student_id=student,
+                defaults={'course_id': self.course_id, 'state': new_state}
+            )
+
+
+    def record_many(self, students, old_states, new_state):
+        """
+        All of `students` at once: one UPDATE for those the index has already, and one INSERT for the rest,
+        or one DELETE, a chunk of students at a time.
+        """
+        self.ensure_indexed()
+        block_model, registration_model = _models()
+        rows = registration_model.objects.filter(block_id=self.block_id)
+        with transaction.atomic():
+            for start in range(0, len(students), CHUNK_SIZE):
+                chunk = students[start:start + CHUNK_SIZE]
+                if new_state is None:
+                    rows.filter(student_id__in=chunk).delete()
+                    continue
+                # Not going by `old_states`: a block indexed just now has these students in their new state already.
+                indexed = set(rows.filter(student_id__in=chunk).values_list('student_id', flat=True))
+                # update() bypasses auto_now.
+                rows.filter(student_id__in=indexed).update(state=new_state, changed=now())
+                registration_model.objects.bulk_create(
+                    registration_model(course_id=self.course_id, block_id=self.block_id, student_id=student,
+                                       state=new_state)
+                    for student in chunk if student not in indexed
+                )
+
+
+def block_summaries(course_id):
+    """
+    The seat usage of every indexed block in the course: a list of dicts with the block's ID, display name,
+    capacity, and a count of students in each state. Two queries, however many blocks there are.
+    """
+    block_model, registration_model = _models()
+    summaries = {}
+    for block_id, display_name, capacity in block_model.objects.filter(course_id=course_id, indexed=True).order_by(
+            'display_name').values_list('block_id', 'display_name', 'capacity'):
+        summary = {'block_id': block_id, 'display_name': display_name, 'capacity': capacity}
+        summary.update((state, 0) for state in STATES)
+        summaries[block_id] = summary
+    counts = registration_model.objects.filter(course_id=course_id).values('block_id', 'state').annotate(
+        count=Count('id'))
+    for row in counts:
+        if row['block_id'] in summaries and row['state'] in STATES:
+            summaries[row['block_id']][row['state']] = row['count']
+    return sorted(summaries.values(), key=lambda summary: summary['display_name'])
+
+
+def student_registrations(course_id, student):
+    """Every master-class of the course `student` is registered for, in whatever state."""
+    block_model, registration_model = _models()
+    rows = list(registration_model.objects.filter(course_id=course_id, student_id=student).values_list(
+        'block_id', 'state'))
+    names = dict(block_model.objects.filter(block_id__in=[block_id for block_id, state in rows]).values_list(
+        'block_id', 'display_name'))
+    return [
+        {'block_id': block_id, 'display_name': names.get(block_id, u""), 'state': state}
+        for block_id, state in rows
+    ]
+
+
+def export_rows(course_id):
+    """
+    Yield every registration in the course as a (block display name, username, email, name, state) tuple,
+    one block at a time, with users looked up a chunk at a time.
+    """
+    block_model, registration_model = _models()
+    for block_id, display_name in block_model.objects.filter(course_id=course_id, indexed=True).order_by(
+            'display_name').values_list('block_id', 'display_name'):
+        rows = registration_model.objects.filter(block_id=block_id).order_by('state', 'changed').values_list(
+            'student_id', 'state')
+        states = dict(rows)
+        for student, user in iter_users(student for student, state in rows):
+            yield display_name, user.username, user.email, user.profile.name, states[student]
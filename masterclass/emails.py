@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Building master-class email messages out of the course email template.
+"""
+
+import re
+import uuid
+
+from django.core import mail
+
+try:
+    from bulk_email.models import CourseEmailTemplate
+    from bulk_email.tasks import _get_course_email_context as get_email_context
+    from bulk_email.tasks import _get_source_address as get_source_address
+    from courseware import courses as CourseData
+except:
+    # Studio, see the same thing in masterclass.py.
+    pass
+
+
+class MessageBuilder(object):
+    """
+    Renders one message for a whole list of recipients.
+
+    The only parts of the course email context that differ between recipients are their email and name,
+    so the template is rendered just once, with unique markers standing in for those two,
+    and every message is then made by pasting the recipient's values where the markers were.
+    Course, context and source address lookups likewise happen once, when the builder is made.
+    """
+
+    RECIPIENT_FIELDS = ('email', 'name')
+
+    def __init__(self, course_id, subject, text):
+        # Instead of sending the email through the rest of the edX bulk mail system,
+        # we're going to use the edX email templater, and then toss the email directly through
+        # the Django mailer.
+        course = CourseData.get_course(course_id)
+        email_template = CourseEmailTemplate.get_template()
+        context = get_email_context(course)
+
+        self.subject = subject
+        self.from_address = get_source_address(course_id, course.display_name_with_default)
+
+        token = uuid.uuid4().hex
+        self.markers = dict((u"[{0}:{1}]".format(token, field), field) for field in self.RECIPIENT_FIELDS)
+        for marker, field in self.markers.items():
+            context[field] = marker
+        self.marker_pattern = re.compile(u"|".join(re.escape(marker) for marker in self.markers))
+
+        self.plaintext_parts = self._compile(email_template.render_plaintext(text, context))
+        self.html_parts = self._compile(email_template.render_htmltext(text, context))
+
+    def _compile(self, rendered):
+        """
+        Split a rendered message into a list of (is_field, value) pairs, where value is either
+        a literal chunk of text, or the name of the recipient field that goes there.
+        """
+        parts = []
+        position = 0
+        for match in self.marker_pattern.finditer(rendered):
+            parts.append((False, rendered[position:match.start()]))
+            parts.append((True, self.markers[match.group(0)]))
+            position = match.end()
+        parts.append((False, rendered[position:]))
+        return parts
+
+    @staticmethod
+    def _fill(parts, values):
+        return u"".join(values[value] if is_field else value for is_field, value in parts)
+
+    def message(self, user):
+        """Make the message for `user`, who should come with their profile already loaded."""
+        values = {'email': user.email, 'name': user.profile.name}
+        email_message = mail.EmailMultiAlternatives(self.subject, self._fill(self.plaintext_parts, values),
+                                                    self.from_address, [user.email])
+        email_message.attach_alternative(self._fill(self.html_parts, values), 'text/html')
+        return email_message
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming CSV exports, and imports.
+"""
+
+import codecs
+import io
+
+import unicodecsv
+
+from django.utils.encoding import iri_to_uri
+from webob.response import Response
+
+
+def csv_lines(header, rows):
+    """
+    Turn `header` and the `rows` iterable into CSV, one line at a time, as byte strings,
+    so that nothing but the current row is ever held in memory.
+    """
+    with io.BytesIO() as handle:
+        writer = unicodecsv.writer(handle, encoding='utf-8', dialect=unicodecsv.excel)
+
+        def line(row):
+            writer.writerow(row)
+            value = handle.getvalue()
+            handle.seek(0)
+            handle.truncate()
+            return value
+
+        # Notice the enforced UTF-8 byte order mark here.
+        # This ensures that Windows Excel can read an UTF-8 encoded CSV correctly
+        # It does not appear to hinder any other programs that can read CSV.
+        yield codecs.BOM_UTF8 + line(header)
+        for row in rows:
+            yield line(row)
+
+
+def csv_response(filename, lines):
+    """A response that sends `lines` as a CSV attachment called `filename`."""
+    # No content length, so this goes out chunked, as fast as the lines are made.
+    return Response(
+        app_iter=lines,
+        content_type="text/csv",
+        cache_control="no-cache",
+        content_disposition="attachment; filename*=UTF-8''{0}".format(iri_to_uri(filename))
+    )
+
+
+def csv_identifiers(handle):
+    """
+    Yield the first non-empty cell of every row of the CSV file `handle`, one row at a time, so that the file
+    is never held in memory whole. Made for lists of usernames or emails, which includes the CSV get_csv makes,
+    header, byte order mark and all.
+    """
+    # Every line is decoded on its own, so a byte order mark is only ever found at the start of the first one.
+    for row in unicodecsv.reader(handle, encoding='utf-8-sig'):
+        cells = [cell.strip() for cell in row if cell.strip()]
+        if cells and cells[0] != u"username":
+            yield cells[0]
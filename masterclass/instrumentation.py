@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of the block's handlers and of the expensive helpers they call.
+
+Set MASTERCLASS_INSTRUMENTATION in Django settings to a list of sinks to turn it on:
+    "memory" -- keep the latest measurements in this process, which the `metrics` handler reports on;
+    "statsd" -- send them to StatsD at MASTERCLASS_STATSD_ADDRESS, ("localhost", 8125) by default.
+
+Every instrumented handler or view call records its wall time, the number of database queries it made,
+and the time spent in each phase: the helpers decorated with `phase` that it called, grouped by phase name.
+Things that happen, rather than take time, such as cache hits, are counted with `count`.
+With instrumentation off, the decorators cost one settings lookup per call.
+"""
+
+import functools
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import connection
+
+# How many of the latest measurements of every metric the memory sink keeps.
+MEMORY_SAMPLES = 1000
+
+_local = threading.local()
+
+
+def _sinks():
+    return getattr(settings, 'MASTERCLASS_INSTRUMENTATION', ())
+
+
+class MemoryCollector(object):
+    """Keeps the latest measurements of every metric, and works out percentiles over them, and keeps counters."""
+
+    def __init__(self, size=MEMORY_SAMPLES):
+        self.samples = defaultdict(lambda: deque(maxlen=size))
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, name, value, kind='ms'):
+        with self.lock:
+            if kind == 'c':
+                self.counters[name] += value
+            else:
+                self.samples[name].append(value)
+
+    def counts(self):
+        """A dict of counter name -> how many times it was counted since this process started."""
+        with self.lock:
+            return dict(self.counters)
+
+    def percentiles(self, points=(50, 90, 99)):
+        """A dict of metric name -> dict of count, and the value at each of the percentile `points`."""
+        with self.lock:
+            samples = dict((name, sorted(values)) for name, values in self.samples.items())
+        report = {}
+        for name, values in samples.items():
+            summary = {'count': len(values)}
+            for point in points:
+                summary['p{0}'.format(point)] = values[min(len(values) - 1, len(values) * point // 100)]
+            report[name] = summary
+        return report
+
+
+class StatsdSink(object):
+    """Sends measurements to StatsD, over UDP, without waiting to hear if they arrived."""
+
+    def __init__(self, address):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, name, value, kind='ms'):
+        try:
+            self.socket.sendto(u"masterclass.{0}:{1:.3f}|{2}".format(name, value, kind).encode('ascii'),
+                               self.address)
+        except socket.error:
+            pass
+
+
+collector = MemoryCollector()
+_statsd = None
+
+
+def _record(name, value, kind='ms'):
+    global _statsd
+    sinks = _sinks()
+    if 'memory' in sinks:
+        collector.record(name, value, kind)
+    if 'statsd' in sinks:
+        if _statsd is None:
+            _statsd = StatsdSink(getattr(settings, 'MASTERCLASS_STATSD_ADDRESS', ("localhost", 8125)))
+        _statsd.record(name, value, kind)
+
+
+def count(name, value=1):
+    """Add `value` to the counter `name`."""
+    if _sinks():
+        _record(name, value, 'c')
+
+
+def _query_count():
+    return len(connection.queries)
+
+
+def instrumented(name):
+    """Measure every call of a handler or view as the metric `name`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks() or getattr(_local, 'phases', None) is not None:
+                # Off, or already inside another measured call, which will account for this one.
+                return function(*args, **kwargs)
+            _local.phases = defaultdict(float)
+            # connection.queries is only filled in when this is on.
+            debug_cursor = connection.force_debug_cursor
+            connection.force_debug_cursor = True
+            queries = _query_count()
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = (time.time() - start) * 1000
+                query_count = _query_count() - queries
+                connection.force_debug_cursor = debug_cursor
+                phases, _local.phases = _local.phases, None
+                _record(name, elapsed)
+                _record(u"{0}.queries".format(name), query_count, 'g')
+                for phase_name, phase_time in phases.items():
+                    _record(u"{0}.{1}".format(name, phase_name), phase_time)
+        return wrapper
+    return decorator
+
+
+def phase(name):
+    """Add the time spent in every call of a helper to the phase `name` of the measured call it's in."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            phases = getattr(_local, 'phases', None)
+            if phases is None or getattr(_local, 'in_phase', False):
+                # Phases nested in other phases are already counted in them.
+                return function(*args, **kwargs)
+            _local.in_phase = True
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                phases[name] += (time.time() - start) * 1000
+                _local.in_phase = False
+        return wrapper
+    return decorator
@@ -3,16 +3,15 @@
 An XBlock that facilitates offline teacher-student gatherings.
 """
 
-import pkg_resources
-
 from xblock.core import XBlock
-from xblock.fields import Scope, Integer, String, Boolean, List
+from xblock.fields import Scope, Integer, String, Boolean, List, DateTime
 from xblock.fragment import Fragment
 
 from django.template import Context as DjangoContext
 from django.template import Template as DjangoTemplate
-from django.utils.encoding import iri_to_uri
-from django.utils.dateparse import parse_date
+from django.core.cache import cache
+from django.utils import timezone, translation
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.timezone import now
 
 # Yeah, yeah.
@@ -20,9 +19,6 @@ from django.contrib.auth.models import User
 
 # And here we reach even deeper into the guts of edX
 try:
-    from bulk_email.models import CourseEmailTemplate
-    from bulk_email.tasks import _get_course_email_context as get_email_context
-    from bulk_email.tasks import _get_source_address as get_source_address
     from courseware import courses as CourseData
 except:
     # Except we're running in Studio, so all of this stuff isn't available.
@@ -31,18 +27,44 @@ except:
     # Thankfully we aren't going to need it while running in Studio.
     pass
 
-from django.core import mail
-
-import codecs, io
-import unicodecsv
+from array import array
+from datetime import datetime
 from operator import itemgetter
 
 from webob.response import Response
 
+import hashlib
+import json
 import logging
+import math
+import pytz
+import six
+
+from django.conf import settings
+
+from . import course_index, push, registration_log, resources
+from .export import csv_identifiers, csv_lines, csv_response
+from .caching import request_cached, forget_request_cache, process_cached, shared
+from .instrumentation import collector, instrumented, phase
+from .users import fetch_user_summaries, iter_users, resolve_users
+from .tasks import queue_email, job_progress
+from .packing import normalize_lists, pack, unpack
+from .registrations import RegistrationIndex, DatabaseRegistrations, APPROVED, PENDING, CANCELLED, WAITLISTED, \
+    STATES, normalize_student_id
 
 log = logging.getLogger(__name__)
 
+# How long the page course staff get is cached for, in seconds, at most.
+# It's replaced as soon as anything on it changes anyway.
+STAFF_VIEW_CACHE_TIMEOUT = 60 * 60
+
+# How many registrants the staff roster shows per page, by default and at most.
+ROSTER_PAGE_SIZE = 50
+ROSTER_MAX_PAGE_SIZE = 200
+
+# What import_roster keeps for a row that matches no user.
+NOT_FOUND = -1
+
 
 @XBlock.needs("user")
 class MasterclassXBlock(XBlock):
@@ -54,15 +76,21 @@ class MasterclassXBlock(XBlock):
     """
 
     @staticmethod
+    @phase('template')
     def render_template_from_string(template_string, **kwargs):
         """Loads the django template for `template_name`"""
         template = DjangoTemplate(template_string)
         return template.render(DjangoContext(kwargs))
 
+    @staticmethod
+    @phase('template')
+    def render_template(path, **kwargs):
+        """Renders the django template in the resource at `path`, compiled once per process."""
+        return resources.template(path).render(DjangoContext(kwargs))
+
     def resource_string(self, path):
-        """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+        """Handy helper for getting resources from our kit, read once per process."""
+        return resources.resource_string(path)
 
     # Settings fields.
 
@@ -97,8 +125,33 @@ class MasterclassXBlock(XBlock):
         default=u""
     )
 
+    opens_at = DateTime(
+        display_name=u"Время открытия регистрации",
+        help=u"С этого момента начинают приниматься заявки на участие, в формате ГГГГ-ММ-ДД ЧЧ:ММ, "
+             u"по часовому поясу платформы. Пусто - сразу.",
+        scope=Scope.settings,
+        default=None
+    )
+
+    closes_at = DateTime(
+        display_name=u"Время закрытия регистрации",
+        help=u"С этого момента заявки на участие больше не принимаются, в формате ГГГГ-ММ-ДД ЧЧ:ММ, "
+             u"по часовому поясу платформы. Пусто - по последнему дню регистрации.",
+        scope=Scope.settings,
+        default=None
+    )
+
     # Student aggregate data.
 
+    packed_registrations = String(
+        help=u"Списки регистрации в сжатом виде, см. packing.py.",
+        scope=Scope.user_state_summary,
+        default=u""
+    )
+
+    # The lists as they used to be stored. Blocks still having them get them packed with the first change,
+    # and until then they are read from here.
+
     approved_registrations = List(
         help=u"Список зарегистрированных студентов.",
         scope=Scope.user_state_summary
@@ -114,17 +167,129 @@ class MasterclassXBlock(XBlock):
         scope=Scope.user_state_summary
     )
 
-    def enlist(self, var, student):
-        """I'm not sure how these List() objects will handle assigning to them, so here's this shorthand."""
-        if student not in var:
-            var.append(student)
+    waitlisted_registrations = List(
+        help=u"Очередь студентов, ожидающих освобождения места.",
+        scope=Scope.user_state_summary
+    )
+
+    registration_version = Integer(
+        help=u"Номер версии списков регистрации, растет с каждым их изменением.",
+        scope=Scope.user_state_summary,
+        default=0
+    )
+
+    @property
+    def registrations(self):
+        """
+        The registration index over the registration lists.
+        It's built once, on first use, and kept in sync with the lists as we change them through it,
+        and the lists are packed back into their field when the block is saved.
 
-    def delist(self, var, student):
-        if student in var:
-            var.remove(student)
+        If MASTERCLASS_REGISTRATION_BACKEND is "database" in Django settings, registrations live in their own
+        tables instead, where concurrent changes can't clobber each other, and the lists only seed them.
+        """
+        index = getattr(self, '_registration_index', None)
+        if index is None:
+            listeners = []
+            if course_index.enabled():
+                listeners.append(self.course_index())
+            if registration_log.enabled():
+                listeners.append(self.registration_log())
+            if push.enabled():
+                listeners.append(self.push_changes())
+            if self.uses_database_registrations():
+                # The lists are only read to seed the tables the first time the block is used.
+                index = DatabaseRegistrations(six.text_type(self.scope_ids.usage_id), self.registration_lists,
+                                              listeners=listeners)
+            else:
+                index = RegistrationIndex(self.registration_lists(), version=self.registration_version,
+                                          on_change=self.registrations_changed, listeners=listeners)
+            self._registration_index = index
+        return index
+
+    def registration_lists(self):
+        """
+        The registration lists, as a dict of state -> list of integer user IDs, the waitlist a deque of them,
+        unpacked from their field, or, if the block has never been changed since they started being packed,
+        read from the old List fields.
+        """
+        if self.packed_registrations:
+            return unpack(self.packed_registrations)
+        return normalize_lists({
+            APPROVED: self.approved_registrations,
+            PENDING: self.pending_registrations,
+            CANCELLED: self.cancelled_registrations,
+            WAITLISTED: self.waitlisted_registrations,
+        })
+
+    def registrations_changed(self, version):
+        self.registration_version = version
+        self._registrations_changed = True
+
+    def push_changes(self):
+        """The registration listener that has save() push the changes to the pages showing the block, see push.py."""
+        if getattr(self, '_push_changes', None) is None:
+            self._push_changes = push.Changes()
+        return self._push_changes
+
+    def save(self):
+        # Packing all the lists on every change would make bulk changes quadratic, so it's done once, here.
+        if getattr(self, '_registrations_changed', False):
+            self.packed_registrations = pack(self._registration_index.lists)
+            for name in ('approved_registrations', 'pending_registrations', 'cancelled_registrations',
+                         'waitlisted_registrations'):
+                if self.fields[name].is_set_on(self):
+                    delattr(self, name)
+            self._registrations_changed = False
+        super(MasterclassXBlock, self).save()
+        # Only now would the pages that hear of the change see it when they ask.
+        changes = getattr(self, '_push_changes', None)
+        if changes is not None and changes.pending:
+            changes.pending = False
+            push.bump(six.text_type(self.scope_ids.usage_id))
+
+    @request_cached
+    def course_index(self):
+        """This block's view of the course-wide registration index, see course_index.py."""
+        def describe():
+            return (self.acquire_parent_name(), self.capacity,
+                    dict((state, self.registrations.students(state)) for state in STATES))
+        return course_index.CourseIndex(six.text_type(self.course_id), six.text_type(self.scope_ids.usage_id),
+                                        describe)
+
+    @request_cached
+    def registration_log(self):
+        """This block's view of the registration log, see registration_log.py, on behalf of the current user."""
+        def describe():
+            return dict((state, self.registrations.students(state)) for state in STATES)
+        return registration_log.RegistrationLog(six.text_type(self.scope_ids.usage_id), self.acquire_student_id(),
+                                                describe)
+
+    @staticmethod
+    def uses_database_registrations():
+        return getattr(settings, 'MASTERCLASS_REGISTRATION_BACKEND', 'fields') == 'database'
+
+    def current_registration_version(self):
+        """
+        The version of the registrations, which changes whenever any of them does.
+        With the lists, it's read straight from its own field, so that the lists themselves don't need loading.
+        """
+        if self.uses_database_registrations():
+            return self.registrations.version()
+        return self.registration_version
+
+    def studio_seats(self):
+        """
+        How many students are approved, and the version of the registrations, as Studio can see them.
+        Studio mustn't seed the registration tables: the lists they're seeded from may well look empty from there.
+        So with the database backend, this is None until the LMS has seeded them.
+        """
+        if self.uses_database_registrations():
+            return DatabaseRegistrations.seats(six.text_type(self.scope_ids.usage_id))
+        return self.registrations.count(APPROVED), self.registration_version
 
     def free_capacity(self):
-        fc = self.capacity - len(self.approved_registrations)
+        fc = self.capacity - self.registrations.count(APPROVED)
         return fc if fc > 0 else 0
 
     def get_last_day(self, date_string):
@@ -134,29 +299,82 @@ class MasterclassXBlock(XBlock):
             return None
         return last_day
 
+    @request_cached
+    def last_day_date(self):
+        return self.get_last_day(self.last_day)
+
+    @request_cached
     def has_ended(self):
+        if self.closes_at and now() >= self.closes_at:
+            return True
         if self.last_day:
-            last_day = self.get_last_day(self.last_day)
+            last_day = self.last_day_date()
             if last_day:
                 if now().date() > last_day:
                     return True
         return False
 
+    @request_cached
+    def has_opened(self):
+        return not self.opens_at or now() >= self.opens_at
+
+    def seconds_until_opening(self):
+        """How long until registration opens, rounded up to a whole second, or 0 if it's open already."""
+        if self.has_opened():
+            return 0
+        return int(math.ceil((self.opens_at - now()).total_seconds()))
+
+    @staticmethod
+    def parse_moment(moment_string):
+        """
+        Parse a moment in the YYYY-MM-DD HH:MM format into an aware datetime in UTC, the way the DateTime fields
+        keep it. Moments without an explicit offset are in the platform's time zone. Returns None if it isn't one.
+        """
+        try:
+            moment = parse_datetime(moment_string.strip().replace(u" ", u"T", 1))
+        except ValueError:
+            return None
+        if moment is None:
+            return None
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, timezone.get_default_timezone())
+        return moment.astimezone(pytz.utc)
+
+    @staticmethod
+    def format_moment(moment):
+        """The opposite of parse_moment, in the platform's time zone."""
+        if moment is None:
+            return u""
+        return timezone.localtime(moment, timezone.get_default_timezone()).strftime("%Y-%m-%d %H:%M")
+
     def registration_status_string(self, student_id):
-        if student_id in self.approved_registrations:
+        state = self.registrations.state_of(student_id)
+        if state == APPROVED:
             return u"Вы зарегистрированы на этот мастер-класс."
-        elif student_id in self.pending_registrations:
+        elif state == PENDING:
             return u"Ваша заявка ожидает одобрения преподавателем."
+        elif state == WAITLISTED:
+            return u"Вы в очереди на участие в этом мастер-классе, ваше место в очереди: {0}. " \
+                   u"Как только освободится место, вы будете зарегистрированы автоматически и получите " \
+                   u"уведомление по почте.".format(self.registrations.waitlist_position(student_id))
         if self.has_ended():
             return u"Прием заявок окончен."
+        if not self.has_opened():
+            return u"Прием заявок откроется {0}.".format(self.format_moment(self.opens_at))
         if not self.free_capacity() and not self.approval_required:
-            return u"Извините, свободных мест больше нет. Если кто-то из других слушателей отзовет свою заявку, " \
-                   u"или количество свободных мест будет увеличено, они могут появиться в будущем."
+            return u"Извините, свободных мест больше нет. Вы можете встать в очередь: если кто-то из других " \
+                   u"слушателей отзовет свою заявку, или количество свободных мест будет увеличено, " \
+                   u"место достанется первому в очереди."
         return u"Вы можете зарегистрироваться на этот мастер-класс."
 
     def registration_button_text(self, student_id):
-        if student_id in self.approved_registrations or student_id in self.pending_registrations:
+        state = self.registrations.state_of(student_id)
+        if state == WAITLISTED:
+            return u"Покинуть очередь"
+        if state in (APPROVED, PENDING):
             return u"Отказаться"
+        if not self.free_capacity() and not self.approval_required:
+            return u"Встать в очередь"
         return u"Зарегистрироваться"
 
     def acquire_student_id(self):
@@ -166,134 +384,158 @@ class MasterclassXBlock(XBlock):
         user_service = self.runtime.service(self, "user")
         xblock_user = user_service.get_current_user()
         if xblock_user is not None:
-            return xblock_user.opt_attrs.get('edx-platform.user_id', None)
+            student = xblock_user.opt_attrs.get('edx-platform.user_id', None)
+            if student is not None:
+                return normalize_student_id(student)
         return None
 
 
-    def acquire_student_name(self, student_id):
-        user = User.objects.get(id=student_id)
-        return user.profile.name
-
-    def acquire_student_email(self, student_id):
-        user = User.objects.get(id=student_id)
-        return user.email
-
-    def acquire_student_username(self, student_id):
-        user = User.objects.get(id=student_id)
-        return user.username
+    @request_cached
+    def get_course(self):
+        return CourseData.get_course(self.course_id)
 
+    @phase('modulestore')
+    @request_cached
     def acquire_course_name(self):
-        return CourseData.get_course(self.course_id).display_name_with_default
+        return shared(u"masterclass.course_name.{0}".format(self.course_id),
+                      lambda: self.get_course().display_name_with_default)
 
+    @phase('modulestore')
+    @request_cached
     def acquire_parent_name(self):
-        return self.xmodule_runtime.get_module(self.get_parent()).display_name_with_default
+        return shared(u"masterclass.parent_name.{0}".format(self.location),
+                      lambda: self.xmodule_runtime.get_module(self.get_parent()).display_name_with_default)
 
+    @request_cached
     def is_user_course_staff(self):
         return self.xmodule_runtime.get_user_role() in ['staff', 'instructor']
 
+    @request_cached
     def get_parent(self):
         return self.runtime.get_block(self.runtime.modulestore.get_parent_location(self.location))
 
+    @phase('email')
     def send_email_to_student(self, receivers, subject, text):
-        # Instead of sending the email through the rest of the edX bulk mail system,
-        # we're going to use the edX email templater, and then toss the email directly through
-        # the Django mailer.
-
-        # We're assuming receivers is a list of User IDs.
-
-        emails = []
-
-        email_template = CourseEmailTemplate.get_template()
-        context = get_email_context(CourseData.get_course(self.course_id))
-        from_address = get_source_address(self.course_id, self.acquire_course_name())
-
-        for student_id in list(set(receivers)):
-            context['email'] = self.acquire_student_email(student_id)
-            context['name'] = self.acquire_student_name(student_id)
-
-            plaintext_message = email_template.render_plaintext(text, context)
-            html_message = email_template.render_htmltext(text, context)
-
-            email_message = mail.EmailMultiAlternatives(subject, plaintext_message, from_address, [context['email']])
-            email_message.attach_alternative(html_message, 'text/html')
-
-            emails.append(email_message)
-
-        connection = mail.get_connection()
-        connection.send_messages(emails)
-
-        return
-
-    def student_view(self, context=None):
         """
-        The primary view of the MasterclassXBlock, shown to students
-        when viewing courses.
+        Queue an email to everyone in `receivers`, which is a list of User IDs.
+        The actual rendering and sending happens out of the request, see tasks.py.
+        Returns the job ID, which email_job_status will report the progress of.
         """
+        return queue_email(self.course_id, receivers, subject, text)
 
-        def _student_record(student):
-            name = self.acquire_student_name(student)
+    @phase('users')
+    def student_records(self, students):
+        """
+        Make the records the staff roster shows for the students in `students`, with one light query per chunk.
+        """
+        summaries = fetch_user_summaries(students)
+        records = []
+        for student in students:
+            summary = summaries.get(student)
+            if summary is None:
+                continue
+            username, email, name = summary
             try:
                 last_name = name.split()[-1]
             except IndexError:
                 last_name = name
-            return {
+            records.append({
                 'id': student,
                 'name': name,
-                'email': self.acquire_student_email(student),
+                'email': email,
                 'last_name': last_name,
-            }
+            })
+        return records
+
+    @instrumented('student_view')
+    def student_view(self, context=None):
+        """
+        The primary view of the MasterclassXBlock, shown to students
+        when viewing courses.
+        """
 
         student = self.acquire_student_id()
 
-        html = self.resource_string("static/html/masterclass.html")
+        # Studio can add places, but can't register anyone or mail them, so the waitlist gets them here.
+        if self.promote_waitlist():
+            self.save()
 
         frag = Fragment()
         frag.add_css(self.resource_string("static/css/masterclass.css"))
         frag.add_javascript(self.resource_string("static/js/src/masterclass.js"))
 
-        approved_registrants_list = []
-        pending_registrants_list = []
-        cancelled_registrants_list = []
-
         if self.is_user_course_staff():
+            # Staff look at it a lot more often than registrations change, and then it's the same for all of them.
+            content = shared(self.staff_view_cache_key(), lambda: self.render_student_view(student),
+                             STAFF_VIEW_CACHE_TIMEOUT, counter='staff_view_cache')
+        else:
+            content = self.render_student_view(student)
+        frag.add_content(content)
+
+        frag.initialize_js('MasterclassXBlock')
+        return frag
 
-            approved_registrants_list = [_student_record(x) for x in self.approved_registrations]
-            cancelled_registrants_list = [_student_record(x) for x in self.cancelled_registrations]
+    def staff_view_cache_key(self, version=None):
+        """
+        The cache key of the page staff get: whatever it depends on is either in the key,
+        or, for the registrations, changes their `version`, which is, and is looked up if not given.
+        """
+        if version is None:
+            version = self.current_registration_version()
+        depends_on = u"|".join(six.text_type(value) for value in (
+            self.display_name, self.capacity, self.approval_required, self.last_day,
+            translation.get_language(), self.uses_database_registrations(), course_index.enabled(),
+            registration_log.enabled(), push.enabled(), getattr(settings, 'MASTERCLASS_STATUS_POLL_INTERVAL', 0),
+        ))
+        return u"masterclass.staff_view.{0}.{1}.{2}".format(self.scope_ids.usage_id, version,
+                                                          hashlib.md5(depends_on.encode('utf8')).hexdigest())
+
+    def render_student_view(self, student):
+        """The HTML of the student view, for course staff as well."""
+        # Staff get the actual lists of registrants a page at a time from the roster handler,
+        # so all the page itself needs is how many there are.
+        approved_count = pending_count = cancelled_count = waitlisted_count = 0
+        if self.is_user_course_staff():
+            approved_count = self.registrations.count(APPROVED)
+            cancelled_count = self.registrations.count(CANCELLED)
+            waitlisted_count = self.registrations.count(WAITLISTED)
+            if course_index.enabled():
+                self.course_index().ensure_indexed()
             if self.approval_required:
-                pending_registrants_list = [_student_record(x) for x in self.pending_registrations]
+                pending_count = self.registrations.count(PENDING)
 
         # I'm getting confused by this condition so let's write it out.
         registration_available = True
         # If registration ended, there's that.
         if self.has_ended():
             registration_available = False
-        # If we have no free places and do not require approval, there's that, too,
-        # but only if the student is not registered already - then they can unsubscribe.
-        if not self.free_capacity() and not self.approval_required and student not in self.approved_registrations:
-            registration_available = False
-
-        frag.add_content(
-            self.render_template_from_string(
-                html,
-                registration_available=registration_available,
-                display_name=self.display_name,
-                capacity=self.capacity,
-                last_day=self.get_last_day(self.last_day),
-                has_ended=self.has_ended(),
-                approval_required=self.approval_required,
-                is_course_staff=self.is_user_course_staff(),
-                free=self.free_capacity(),
-                button_text=self.registration_button_text(student),
-                approved_registrants=sorted(approved_registrants_list, key=itemgetter('last_name')),
-                pending_registrants=sorted(pending_registrants_list, key=itemgetter('last_name')),
-                cancelled_registrants=sorted(cancelled_registrants_list, key=itemgetter('last_name')),
-                status_string=self.registration_status_string(student),
-            )
+        # If we have no free places and do not require approval, students can still join the waitlist.
+        # If registration hasn't opened yet, the button is there, but disabled until it does.
+
+        return self.render_template(
+            "static/html/masterclass.html",
+            registration_available=registration_available,
+            status_poll_interval=getattr(settings, 'MASTERCLASS_STATUS_POLL_INTERVAL', 0),
+            # Staff don't register, and what they get is cached, so they get no countdown.
+            opens_in=0 if self.is_user_course_staff() else self.seconds_until_opening(),
+            display_name=self.display_name,
+            capacity=self.capacity,
+            last_day=self.last_day_date(),
+            has_ended=self.has_ended(),
+            approval_required=self.approval_required,
+            is_course_staff=self.is_user_course_staff(),
+            free=self.free_capacity(),
+            button_text=self.registration_button_text(student),
+            approved_count=approved_count,
+            pending_count=pending_count,
+            cancelled_count=cancelled_count,
+            waitlisted_count=waitlisted_count,
+            course_index_enabled=course_index.enabled(),
+            push_enabled=push.enabled(),
+            registration_log_enabled=registration_log.enabled(),
+            status_string=self.registration_status_string(student),
         )
 
-        frag.initialize_js('MasterclassXBlock')
-        return frag
-
     # Note that when editing the course in studio, it renders author_view and falls back to student_view.
     # studio_view is the edit-data page.
 
@@ -306,6 +548,8 @@ class MasterclassXBlock(XBlock):
         cls = type(self)
 
         def none_to_empty(x):
+            if isinstance(x, datetime):
+                return self.format_moment(x)
             return x if x is not None else ''
 
         edit_fields = (
@@ -315,11 +559,12 @@ class MasterclassXBlock(XBlock):
                 (cls.capacity, 'number'),
                 (cls.approval_required, 'boolean'),
                 (cls.last_day, 'date_string'),
+                (cls.opens_at, 'datetime_string'),
+                (cls.closes_at, 'datetime_string'),
             ))
 
-        html = self.resource_string('static/html/masterclass_studio.html')
         fragment = Fragment()
-        fragment.add_content(self.render_template_from_string(html, fields=edit_fields))
+        fragment.add_content(self.render_template('static/html/masterclass_studio.html', fields=edit_fields))
         fragment.add_javascript(self.resource_string("static/js/src/masterclass_studio.js"))
         fragment.add_css(self.resource_string("static/css/masterclass.css"))
         fragment.initialize_js('MasterclassXBlockStudio')
@@ -333,45 +578,260 @@ class MasterclassXBlock(XBlock):
         It's not like there's a point in seeing the register button there anyway.
         """
 
-        html = self.resource_string('static/html/masterclass_author.html')
+        seats = self.studio_seats()
         fragment = Fragment()
         fragment.add_css(self.resource_string("static/css/masterclass.css"))
-        fragment.add_content(self.render_template_from_string(html,
-                                                              approval_required=self.approval_required,
-                                                              display_name=self.display_name,
-                                                              capacity=self.capacity,
-                                                              free=self.free_capacity()))
+        fragment.add_content(self.render_template('static/html/masterclass_author.html',
+                                                  approval_required=self.approval_required,
+                                                  display_name=self.display_name,
+                                                  capacity=self.capacity,
+                                                  free=max(self.capacity - seats[0], 0) if seats else self.capacity))
         return fragment
 
     @XBlock.json_handler
+    @instrumented('approval_button')
     def approval_button(self, data, suffix=''):
         """
         Handle the approve button in registrants list view.
         """
 
-        student = data['student_id']
+        student = normalize_student_id(data['student_id'])
 
-        if self.approval_required and student in self.pending_registrations:
-            self.delist(self.pending_registrations, student)
-            self.enlist(self.approved_registrations, student)
+        if self.approval_required and self.registrations.transition(student, APPROVED, from_states=(PENDING,),
+                                                                    capacity=self.capacity):
 
-            # For the moment that will suffice, I need to test the whole email mechanism first...
-            self.send_email_to_student([student], u"О вашей регистрации на мастер-класс.",
-                                       u"Ваша заявка на мастер-класс {course_name} - {parent_name} была одобрена.".format(
+            self.send_approval_email([student])
+            return {'status': "ok", 'student_id': student, 'capacity': self.capacity,
+                    'free_places': self.free_capacity()}
+        else:
+            # The page was out of date: the places ran out, or someone else approved or withdrew the student first.
+            return {'status': "fail", 'student_id': student, 'capacity': self.capacity,
+                    'free_places': self.free_capacity()}
+
+    @XBlock.json_handler
+    @instrumented('bulk_approval')
+    def bulk_approval(self, data, suffix=''):
+        """
+        Approve many pending students at once: either those in `student_ids`, or the `first` so many
+        in the order they applied. Whoever doesn't fit into the free places stays pending.
+        Everyone approved gets their email in one batch.
+        """
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff tried to approve master-class registrants.")
+            return
+
+        if not self.approval_required:
+            return {'status': "fail"}
+
+        if 'first' in data:
+            try:
+                first = int(data['first'])
+            except (TypeError, ValueError):
+                return {'status': "fail"}
+            students = self.registrations.students(PENDING)[:max(first, 0)]
+        else:
+            try:
+                students = [normalize_student_id(student) for student in data.get('student_ids') or []]
+            except (TypeError, ValueError):
+                return {'status': "fail"}
+
+        approved = self.registrations.transition_many(students, APPROVED, from_states=(PENDING,),
+                                                      capacity=self.capacity)
+        if approved:
+            self.send_approval_email(approved)
+
+        return {
+            'status': "ok",
+            'student_ids': approved,
+            'capacity': self.capacity,
+            'free_places': self.free_capacity(),
+        }
+
+    @XBlock.handler
+    @instrumented('import_roster')
+    def import_roster(self, request, suffix=''):
+        """
+        Register many students at once, approval or not: everyone in an uploaded CSV file of usernames or emails,
+        one per row, such as the one get_csv makes, or in a JSON list of them.
+        The users are looked up a chunk at a time while the upload is read, and only a number per row is kept
+        of it: the student ID, or NOT_FOUND. All the registrations then change at once, as far as the free places
+        go. The response has the number of students registered and, for every row that wasn't, the reason why.
+        """
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff tried to import master-class registrants.")
+            return
+
+        if request.content_type == 'application/json':
+            try:
+                identifiers = json.loads(request.body.decode('utf8'))
+            except ValueError:
+                identifiers = None
+            if not isinstance(identifiers, list):
+                return Response(json.dumps({'status': "fail"}), content_type='application/json', charset='utf8')
+            identifiers = [six.text_type(identifier).strip() for identifier in identifiers]
+        else:
+            upload = request.POST.get('file')
+            identifiers = csv_identifiers(upload.file if hasattr(upload, 'file') else request.body_file)
+
+        # One student ID per row, and every student once, in the order of their first row.
+        codes = array('l')
+        students = []
+        first_rows = set()
+        missing = {}
+        for number, (identifier, student) in enumerate(resolve_users(identifiers), 1):
+            if student is None:
+                codes.append(NOT_FOUND)
+                missing[number] = identifier
+            else:
+                codes.append(student)
+                if student not in first_rows:
+                    first_rows.add(student)
+                    students.append(student)
+
+        registered = set(self.registrations.transition_many(students, APPROVED,
+                                                            from_states=(None, PENDING, CANCELLED, WAITLISTED),
+                                                            capacity=self.capacity))
+        if registered:
+            self.send_email_to_student([student for student in students if student in registered],
+                                       u"О вашей регистрации на мастер-класс.",
+                                       u"Вы были зарегистрированы на мастер-класс {course_name} - {parent_name}.".format(
                                            course_name=self.acquire_course_name(),
                                            parent_name=self.acquire_parent_name()))
-            return {'student_id': student, 'capacity': self.capacity, 'free_places': self.free_capacity()}
-        else:
-            # Shouldn't happen.
-            raise
+        del students
+
+        problems = []
+        for number, student in enumerate(codes, 1):
+            if student == NOT_FOUND:
+                result = "not_found"
+            elif student not in first_rows:
+                result = "duplicate"
+            else:
+                first_rows.discard(student)
+                if student in registered:
+                    continue
+                elif self.registrations.state_of(student) == APPROVED:
+                    result = "already_registered"
+                else:
+                    result = "no_places"
+            problems.append((number, student, result))
+        del codes
+
+        # Rows are named by what they said if nobody matched them, and by the username if somebody did.
+        summaries = fetch_user_summaries(student for number, student, result in problems if student != NOT_FOUND)
+        results = []
+        for number, student, result in problems:
+            if student == NOT_FOUND:
+                name = missing[number]
+            else:
+                name = summaries.get(student, (six.text_type(student),))[0]
+            results.append({'row': number, 'student': name, 'result': result})
+
+        return Response(json.dumps({
+            'status': "ok",
+            'registered': len(registered),
+            'rows': results,
+            'capacity': self.capacity,
+            'free_places': self.free_capacity(),
+        }), content_type='application/json', charset='utf8')
+
+    def promote_waitlist(self):
+        """Register students from the head of the waitlist into whatever places are free, and let them know."""
+        if not self.free_capacity():
+            return []
+        promoted = self.registrations.promote(self.capacity)
+        if promoted:
+            self.send_email_to_student(promoted, u"О вашей регистрации на мастер-класс.",
+                                       u"Для вас освободилось место на мастер-классе {course_name} - {parent_name}, "
+                                       u"и вы были на него зарегистрированы.".format(
+                                           course_name=self.acquire_course_name(),
+                                           parent_name=self.acquire_parent_name()))
+        return promoted
+
+    def send_approval_email(self, students):
+        # For the moment that will suffice, I need to test the whole email mechanism first...
+        return self.send_email_to_student(students, u"О вашей регистрации на мастер-класс.",
+                                          u"Ваша заявка на мастер-класс {course_name} - {parent_name} "
+                                          u"была одобрена.".format(course_name=self.acquire_course_name(),
+                                                                   parent_name=self.acquire_parent_name()))
+
+    @XBlock.json_handler
+    @instrumented('roster')
+    def roster(self, data, suffix=''):
+        """
+        One page of the registrants in a given state, sorted by last name (or, for the waitlist, in line order),
+        optionally only those whose name or email contains the search string.
+        """
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested the list of master-class registrants")
+            return
+
+        state = data.get('state')
+        if state not in STATES:
+            return {'status': "fail"}
+
+        try:
+            page = int(data.get('page', 1))
+            page_size = min(max(int(data.get('page_size', ROSTER_PAGE_SIZE)), 1), ROSTER_MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return {'status': "fail"}
+
+        records = self.sorted_roster(state)
+        search = (data.get('search') or u"").strip().lower()
+        if search:
+            records = [record for record in records if search in record['search']]
+
+        pages = max(1, (len(records) + page_size - 1) // page_size)
+        page = min(max(page, 1), pages)
+        students = records[(page - 1) * page_size:page * page_size]
+
+        return {
+            'status': "ok",
+            'state': state,
+            'page': page,
+            'pages': pages,
+            'total': len(records),
+            'students': [dict((key, record[key]) for key in ('id', 'name', 'email')) for record in students],
+            'capacity': self.capacity,
+            'free_places': self.free_capacity(),
+        }
+
+    def sorted_roster(self, state):
+        """
+        The roster records of everyone in `state`, sorted for showing, with a lowercase 'search' string of their name
+        and email each. Kept in this process until the registrations change, so that paging and searching through
+        the roster, which staff do a lot, doesn't look everybody up and sort them again every time.
+        """
+        def compute():
+            records = self.student_records(self.registrations.students(state))
+            if state != WAITLISTED:
+                # The waitlist is shown in the order of the line, everything else alphabetically.
+                records.sort(key=itemgetter('last_name'))
+            for record in records:
+                record['search'] = u"{0}\n{1}".format(record['name'], record['email']).lower()
+            return records
+        return process_cached((u"masterclass.roster", six.text_type(self.scope_ids.usage_id), state,
+                               self.uses_database_registrations(), self.current_registration_version()),
+                              compute, counter='roster_cache')
 
     @XBlock.json_handler
+    @instrumented('register_button')
     def register_button(self, data, suffix=''):
         """
         Handle the register button in LMS. Notice this button both registers and unregisters.
         """
 
+        # Everybody clicks at the moment registration opens, and some a little before that,
+        # so turning those away mustn't need as much as a look at the registrations.
+        if not self.has_opened():
+            return {
+                'registration_status': u"Прием заявок еще не открыт.",
+                "button_text": u"Зарегистрироваться",
+                'opens_in': self.seconds_until_opening(),
+            }
+
         student = self.acquire_student_id()
+        # If places were added in Studio since anyone last looked, whoever waits for them goes ahead of this student.
+        self.promote_waitlist()
 
         if student is None:
             return {
@@ -381,22 +841,31 @@ class MasterclassXBlock(XBlock):
                 'free_places': self.free_capacity(),
             }
 
-        if student in self.pending_registrations:
-            self.delist(self.pending_registrations, student)
-            self.enlist(self.cancelled_registrations, student)
+        # Every change is conditional on the state we saw, so if somebody else's request got in between,
+        # (say, the student double-clicked, or the last seat went) we report the state as it is instead.
+        state = self.registrations.state_of(student)
+        # Those already registered can still cancel once registration closes, nobody new can come in.
+        may_register = state in (None, CANCELLED) and not self.has_ended()
+        if state == PENDING and self.registrations.transition(student, CANCELLED, from_states=(PENDING,)):
             result_message = u"Вы отменили заявку на участие в этом мастер-классе."
-        elif student in self.approved_registrations:
-            self.delist(self.approved_registrations, student)
-            self.enlist(self.cancelled_registrations, student)
+        elif state == APPROVED and self.registrations.transition(student, CANCELLED, from_states=(APPROVED,)):
             result_message = u"Вы отказались от участия в этом мастер-классе."
+            # The place that just freed up goes to whoever is first in line.
+            self.promote_waitlist()
+        elif state == WAITLISTED and self.registrations.transition(student, CANCELLED, from_states=(WAITLISTED,)):
+            result_message = u"Вы покинули очередь на участие в этом мастер-классе."
+        elif may_register and self.approval_required \
+                and self.registrations.transition(student, PENDING, from_states=(None, CANCELLED)):
+            result_message = u"Ваша заявка ожидает одобрения преподавателем."
+        elif may_register and not self.approval_required \
+                and self.registrations.transition(student, APPROVED, from_states=(None, CANCELLED),
+                                                  capacity=self.capacity):
+            result_message = u"Вы были успешно зарегистрированы."
+        elif may_register and not self.approval_required \
+                and self.registrations.transition(student, WAITLISTED, from_states=(None, CANCELLED)):
+            result_message = self.registration_status_string(student)
         else:
-            self.delist(self.cancelled_registrations, student)
-            if self.approval_required:
-                self.enlist(self.pending_registrations, student)
-                result_message = u"Ваша заявка ожидает одобрения преподавателем."
-            else:
-                self.enlist(self.approved_registrations, student)
-                result_message = u"Вы были успешно зарегистрированы."
+            result_message = self.registration_status_string(student)
 
         return {
             'registration_status': result_message,
@@ -405,10 +874,7 @@ class MasterclassXBlock(XBlock):
             'free_places': self.free_capacity(),
         }
 
-    @XBlock.json_handler
-    def refresh_display(self, data, suffix=''):
-        student = self.acquire_student_id()
-
+    def status_payload(self, student):
         if student is None:
             result_message = u"Не записанные на курс студенты не могут участвовать в мастер-классах."
             button_text = u"Зарегистрироваться"
@@ -420,52 +886,196 @@ class MasterclassXBlock(XBlock):
             "button_text": button_text,
             'capacity': self.capacity,
             'free_places': self.free_capacity(),
+            'opens_in': self.seconds_until_opening(),
         }
 
+    def status_etag(self, student):
+        """
+        An ETag for what `status` would tell `student`, computed without looking at the registrations themselves.
+        Everything the status depends on goes in: the registration version, the settings, the date and the student.
+        With push on, the number of the latest change stands in for the registration version, see push.py.
+        """
+        version = push.version(six.text_type(self.scope_ids.usage_id)) if push.enabled() else None
+        version = u"push:{0}".format(version) if version is not None else self.current_registration_version()
+        key = u"{0}|{1}|{2}|{3}|{4}|{5}|{6}|{7}".format(version, student, self.capacity,
+                                                     self.approval_required, self.last_day, self.has_ended(),
+                                                     self.opens_at, self.has_opened())
+        return hashlib.md5(key.encode('utf8')).hexdigest()
+
+    @XBlock.json_handler
+    @instrumented('refresh_display')
+    def refresh_display(self, data, suffix=''):
+        self.promote_waitlist()
+        return self.status_payload(self.acquire_student_id())
+
+    @XBlock.handler
+    @instrumented('status')
+    def status(self, request, suffix=''):
+        """
+        A cheap GET version of refresh_display, meant for polling.
+        Answers 304 Not Modified, without building any of the status, if the client's ETag is still current.
+        """
+        student = self.acquire_student_id()
+        etag = self.status_etag(student)
+        if etag in request.if_none_match:
+            return Response(status=304, etag=etag, cache_control="private, no-cache")
+        return Response(json.dumps(self.status_payload(student)), content_type='application/json', charset='utf8',
+                        etag=etag, cache_control="private, no-cache")
+
+    @XBlock.handler
+    def updates(self, request, suffix=''):
+        """
+        Long polling for changes, see push.py. Waits, for a few seconds at most, until the block has changed since
+        the change numbered ?after=, and answers with the number of the latest change, and, if there was one,
+        the student's new status. Without ?after=, answers straight away with the number alone.
+        A null number means the cache won't keep one, and the page has to poll the status instead.
+        """
+        if not push.enabled():
+            return Response(status=404)
+
+        try:
+            after = int(request.GET['after'])
+        except (KeyError, ValueError):
+            after = None
+
+        # Nothing but the cache is looked at until there's something to tell.
+        seq = push.wait(six.text_type(self.scope_ids.usage_id), after, push.timeout())
+        result = {'seq': seq}
+        if after is not None and seq is not None and seq != after:
+            result['status'] = self.status_payload(self.acquire_student_id())
+        return Response(json.dumps(result), content_type='application/json', charset='utf8',
+                        cache_control="private, no-cache")
+
     @XBlock.handler
-    def get_csv(self, data, suffix=''):
-        """This function should send a CSV of all the approved registrants to the user."""
+    @instrumented('get_csv')
+    def get_csv(self, request, suffix=''):
+        """
+        This function should send a CSV of all the approved registrants to the user.
+        With ?state=all in the query, it sends everyone who ever registered instead, with their state in a column.
+        """
 
         if not self.is_user_course_staff():
             log.error("Somehow someone other than course staff has requested a CSV of master-class registrants")
             return
 
-        results = []
-
         parent_name = self.acquire_parent_name()
         course_name = self.acquire_course_name()
 
-        filename = u"{0} - {1}.csv".format(course_name, parent_name)
+        if request.GET.get('state') == 'all':
+            filename = u"{0} - {1} - all.csv".format(course_name, parent_name)
+            rows = self.csv_rows(STATES, with_state=True)
+        else:
+            filename = u"{0} - {1}.csv".format(course_name, parent_name)
+            rows = self.csv_rows([APPROVED])
+
+        return csv_response(filename, rows)
+
+    def csv_rows(self, states, with_state=False):
+        """
+        Make the CSV of registrants in `states` line by line, as byte strings, looking the users up
+        a chunk at a time, so that memory use stays the same however many registrants there are.
+        """
+        # The lists are taken now, rather than whenever the consumer gets around to it.
+        registrants = [(state, self.registrations.students(state)) for state in states]
+
+        header = ["username", "email", "name"]
+        if with_state:
+            header.append("state")
+
+        def rows():
+            for state, students in registrants:
+                for student, user in iter_users(students):
+                    row = [user.username, user.email, user.profile.name]
+                    if with_state:
+                        row.append(state)
+                    yield row
+
+        return csv_lines(header, rows())
+
+    @XBlock.json_handler
+    def registration_history(self, data, suffix=''):
+        """Every change of the registration of the `student`, given by username or email, from the registration log."""
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested a master-class registration history")
+            return
+
+        if not registration_log.enabled():
+            return {'status': "fail"}
+
+        query = (data.get('student') or u"").strip()
+        user = query and (User.objects.filter(username=query).first() or User.objects.filter(email=query).first())
+        if not user:
+            return {'status': "fail"}
+        return {
+            'status': "ok",
+            'username': user.username,
+            'history': registration_log.student_history(six.text_type(self.scope_ids.usage_id), user.id),
+        }
+
+    @XBlock.handler
+    def registration_log_csv(self, request, suffix=''):
+        """
+        The registration log as CSV, optionally only from the day in ?since= through the day in ?until=,
+        both in the YYYY-MM-DD format.
+        """
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested a master-class registration log")
+            return
+
+        if not registration_log.enabled():
+            return
 
-        for student in self.approved_registrations:
-            results.append(
-                {
-                    "username": self.acquire_student_username(student),
-                    "email": self.acquire_student_email(student),
-                    "name": self.acquire_student_name(student),
+        since = self.get_last_day(request.GET.get('since', u""))
+        until = self.get_last_day(request.GET.get('until', u""))
+        filename = u"{0} - {1} - log.csv".format(self.acquire_course_name(), self.acquire_parent_name())
+        rows = registration_log.export_rows(six.text_type(self.scope_ids.usage_id),
+                                            since=registration_log.day_start(since) if since else None,
+                                            until=registration_log.day_end(until) if until else None)
+        return csv_response(filename, csv_lines(["time", "username", "email", "name", "old_state", "new_state",
+                                                 "actor"], rows))
+
+    @XBlock.json_handler
+    def course_dashboard(self, data, suffix=''):
+        """
+        Seat usage of every master-class in the course, and, given a `student` username or email,
+        everything that student is registered for, all from the course-wide index.
+        """
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested the master-class dashboard")
+            return
+
+        if not course_index.enabled():
+            return {'status': "fail"}
+
+        course_id = six.text_type(self.course_id)
+        result = {'status': "ok", 'blocks': course_index.block_summaries(course_id)}
+
+        query = (data.get('student') or u"").strip()
+        if query:
+            user = User.objects.filter(username=query).first() or User.objects.filter(email=query).first()
+            if user is not None:
+                result['student'] = {
+                    'username': user.username,
+                    'registrations': course_index.student_registrations(course_id, user.id),
                 }
-            )
-
-        if len(results):
-            with io.BytesIO() as handle:
-                writer = unicodecsv.DictWriter(handle, results[0].keys(), encoding='utf-8',
-                                               dialect=unicodecsv.excel)
-                writer.writeheader()
-                for row in results:
-                    writer.writerow(row)
-                # Notice the enforced UTF-8 byte order mark here.
-                # This ensures that Windows Excel can read an UTF-8 encoded CSV correctly
-                # It does not appear to hinder any other programs that can read CSV.
-                output_string = codecs.BOM_UTF8 + handle.getvalue()
-
-            return Response(
-                body=output_string,
-                content_type="text/csv",
-                cache_control="no-cache",
-                content_disposition="attachment; filename*=UTF-8''{0}".format(iri_to_uri(filename))
-            )
+        return result
+
+    @XBlock.handler
+    def course_dashboard_csv(self, request, suffix=''):
+        """Every master-class registration in the course, as CSV, from the course-wide index."""
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested a CSV of all master-class registrants")
+            return
+
+        if not course_index.enabled():
+            return
+
+        filename = u"{0} - masterclasses.csv".format(self.acquire_course_name())
+        return csv_response(filename, csv_lines(["masterclass", "username", "email", "name", "state"],
+                                                course_index.export_rows(six.text_type(self.course_id))))
 
     @XBlock.json_handler
+    @instrumented('send_mail_to_all')
     def send_mail_to_all(self, data, suffix=''):
         if not self.is_user_course_staff():
             log.error("Somehow someone other than course staff tried to send mail to all master-class registrants.")
@@ -474,21 +1084,75 @@ class MasterclassXBlock(XBlock):
         subject = data.get('subject')
         text = data.get('text')
         if subject and text:
-            self.send_email_to_student(self.approved_registrations + [self.acquire_student_id()], subject, text)
-            return {'status': "ok"}
+            job_id = self.send_email_to_student(self.registrations.students(APPROVED) + [self.acquire_student_id()],
+                                                subject, text)
+            return {'status': "ok", 'job_id': job_id}
         else:
             return {'status': "fail"}
 
+    @XBlock.json_handler
+    def email_job_status(self, data, suffix=''):
+        """Report how far along the email job started by send_mail_to_all is."""
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff asked about master-class email progress.")
+            return
+
+        progress = job_progress(data.get('job_id', ''))
+        if progress is None:
+            return {'status': "fail"}
+        progress['status'] = "ok"
+        return progress
+
+    @XBlock.json_handler
+    def metrics(self, data, suffix=''):
+        """Percentiles of the latest timings this process collected, when instrumentation is on."""
+        if not self.is_user_course_staff():
+            log.error("Somehow someone other than course staff has requested master-class metrics.")
+            return
+
+        return {'status': "ok", 'metrics': collector.percentiles(), 'counters': collector.counts()}
+
     @XBlock.json_handler
     def save_masterclass(self, data, suffix=''):
         """Save settings in Studio"""
-        for name in ['display_name', 'capacity']:
-            setattr(self, name, data.get(name, getattr(self, name)))
+        # Both moments are parsed and checked once, here, before anything is saved,
+        # and kept as datetimes from then on.
+        moments = {}
+        for name in ['opens_at', 'closes_at']:
+            moment_string = (data.get(name) or u"").strip()
+            moments[name] = self.parse_moment(moment_string) if moment_string else None
+            if moment_string and moments[name] is None:
+                return {'status': "fail",
+                        'message': u"Время должно быть в формате ГГГГ-ММ-ДД ЧЧ:ММ: {0}".format(moment_string)}
+        if moments['opens_at'] and moments['closes_at'] and moments['opens_at'] >= moments['closes_at']:
+            return {'status': "fail", 'message': u"Регистрация должна открываться раньше, чем закрываться."}
+        # It comes as a string from the form, and everything counting seats needs a number.
+        try:
+            capacity = int(data.get('capacity', self.capacity))
+        except (TypeError, ValueError):
+            capacity = -1
+        if capacity < 0:
+            return {'status': "fail", 'message': u"Количество мест должно быть целым неотрицательным числом."}
+        # The new settings make a new key anyway, this is just so the old page doesn't hang around.
+        seats = self.studio_seats()
+        if seats is not None:
+            cache.delete(self.staff_view_cache_key(seats[1]))
+        self.display_name = data.get('display_name', self.display_name)
+        self.capacity = capacity
         if data.get('approval_required', '').lower() in ["true", "yes", "1"]:
             self.approval_required = True
         else:
             self.approval_required = False
         if self.get_last_day(data.get('last_day', '')):
             self.last_day = data.get('last_day', '')
+        self.opens_at = moments['opens_at']
+        self.closes_at = moments['closes_at']
+        # Whatever we worked out from the old settings doesn't hold anymore.
+        forget_request_cache(self)
+        if push.enabled():
+            # Nobody's registration changed, but everyone's status might have.
+            self.push_changes().pending = True
+        if course_index.enabled():
+            self.course_index().update_block(capacity=self.capacity)
 
 
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+The compact form the registration lists are stored in: one short string for all of them.
+
+It looks like "1;approved:<ids>;pending:<ids>;...", where 1 is the format version, and each <ids> is
+the list's user IDs as differences from the previous ID, zigzag-encoded to keep them unsigned,
+as variable-length integers, in URL-safe base64. The lists whose order means nothing are sorted first,
+which keeps the differences, and so the string, small; those whose order does mean something
+(the order of application, and the line of the waitlist) are kept as they are.
+
+Unpacked, the waitlist is a deque, since students are taken off the head of it, and every other list a list.
+"""
+
+import base64
+import logging
+from collections import deque
+
+import six
+
+from .registrations import APPROVED, CANCELLED, STATES, WAITLISTED, normalize_student_id
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Registration lists stored in ID order rather than the order students got there.
+UNORDERED_STATES = (APPROVED, CANCELLED)
+
+
+def _encode(numbers):
+    data = bytearray()
+    previous = 0
+    for number in numbers:
+        delta = number - previous
+        previous = number
+        value = delta * 2 if delta >= 0 else -delta * 2 - 1
+        while value > 0x7f:
+            data.append((value & 0x7f) | 0x80)
+            value >>= 7
+        data.append(value)
+    return base64.urlsafe_b64encode(bytes(data)).decode('ascii')
+
+
+def _decode(text):
+    numbers = []
+    previous = value = shift = 0
+    for byte in bytearray(base64.urlsafe_b64decode(text.encode('ascii'))):
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value // 2 if not value & 1 else -(value + 1) // 2
+        numbers.append(previous)
+        value = shift = 0
+    return numbers
+
+
+def _in_memory(lists):
+    """`lists` with the waitlist made a deque."""
+    lists[WAITLISTED] = deque(lists[WAITLISTED])
+    return lists
+
+
+def normalize_lists(lists):
+    """
+    The registration lists in `lists` with every ID made an integer, and repeats and anything
+    that isn't an ID at all dropped, which is what the lists of the old, plain format need.
+    """
+    normalized = {}
+    for state in STATES:
+        seen = set()
+        normalized[state] = []
+        for student in lists.get(state) or ():
+            try:
+                student = normalize_student_id(student)
+            except (TypeError, ValueError):
+                log.warning("Dropped %r from the %s master-class registrations, it isn't a user ID.", student, state)
+                continue
+            if student not in seen:
+                seen.add(student)
+                normalized[state].append(student)
+    return _in_memory(normalized)
+
+
+def pack(lists):
+    """
+    The compact string form of the registration lists in `lists`, a dict of state -> list, or deque,
+    of integer IDs.
+    """
+    parts = [six.text_type(FORMAT_VERSION)]
+    for state in STATES:
+        students = lists.get(state) or []
+        if state in UNORDERED_STATES:
+            students = sorted(students)
+        parts.append(u"{0}:{1}".format(state, _encode(students)))
+    return u";".join(parts)
+
+
+def unpack(text):
+    """
+    The registration lists, as a dict of state -> list of integer IDs, the waitlist a deque of them,
+    from their compact string form.
+    """
+    version, _, rest = text.partition(u";")
+    if version != six.text_type(FORMAT_VERSION):
+        raise ValueError(u"Unknown master-class registration format: {0}".format(version))
+    lists = dict((state, []) for state in STATES)
+    for part in rest.split(u";") if rest else ():
+        state, _, ids = part.partition(u":")
+        # A state this version doesn't know of would have nowhere to go.
+        if state in lists:
+            lists[state] = _decode(ids)
+    return _in_memory(lists)
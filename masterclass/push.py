@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Pushing the status of a master-class to the pages showing it, as soon as its registrations change.
+
+Every change of a block's registrations, or its settings, bumps a counter of the block's in the Django cache
+once it's saved. Pages keep a request to the `updates` handler open with the number they saw last, and the
+handler waits for the counter to move past it, looking at nothing but the cache while it does, and answers
+with the page's new status as soon as it has. However many people are watching, nothing touches
+the registrations until something has changed.
+
+A waiting request holds a server worker, so it only waits for MASTERCLASS_PUSH_TIMEOUT seconds, and then
+the page asks again. The status handler's ETag is made from the counter as well, so that a poll which finds
+nothing new is answered from the cache alone.
+
+The counter is shared by whichever server processes share the cache, so with more than one of them, the cache
+has to be a shared one, like memcached or Redis. Should the counter get evicted, it starts over from the time
+in milliseconds, rather than from zero, so that it doesn't go back to a number some page still has.
+
+Settings:
+    MASTERCLASS_PUSH -- on or off, off by default. Pages poll the status handler instead when it's off.
+    MASTERCLASS_PUSH_TIMEOUT -- how many seconds a request to `updates` waits for a change, 5 by default.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .registrations import Listener
+
+DEFAULT_TIMEOUT = 5
+
+# How often a waiting request looks at the counter, in seconds.
+WAIT_STEP = 0.25
+
+
+def enabled():
+    return bool(getattr(settings, 'MASTERCLASS_PUSH', False))
+
+
+def timeout():
+    return getattr(settings, 'MASTERCLASS_PUSH_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _key(block_id):
+    return u"masterclass.push.{0}".format(block_id)
+
+
+def _fresh():
+    return int(time.time() * 1000)
+
+
+def version(block_id):
+    """
+    The number of the latest change of `block_id`, or None if the cache won't keep one,
+    in which case the registration version has to do.
+    """
+    key = _key(block_id)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _fresh(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump(block_id):
+    """Let pages know `block_id` changed. Only call it once the change is saved."""
+    key = _key(block_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Whatever number a page has, it's older than this.
+        cache.add(key, _fresh(), None)
+
+
+def wait(block_id, after, timeout):
+    """
+    Wait up to `timeout` seconds for the number of the latest change of `block_id` to be other than `after`,
+    and return it. Doesn't wait at all if `after` is None, or the cache won't keep the number.
+    """
+    deadline = time.time() + timeout
+    while True:
+        value = version(block_id)
+        if after is None or value is None or value != after:
+            return value
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return value
+        time.sleep(min(WAIT_STEP, remaining))
+
+
+class Changes(Listener):
+    """A registration listener that notes whether there were any changes to `bump` about once they're saved."""
+
+    def __init__(self):
+        self.pending = False
+
+    def record(self, student, old_state, new_state):
+        self.pending = True
+
+    def record_many(self, students, old_states, new_state):
+        self.pending = True
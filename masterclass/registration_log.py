@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+An append-only log of every change of every registration: who went from what state to what, when,
+and at whose request.
+
+When MASTERCLASS_REGISTRATION_LOG is on in Django settings, every registration change is appended here,
+whichever storage the block keeps its registrations in. This needs "masterclass_storage" in INSTALLED_APPS
+and its migrations applied.
+
+The registrations of a block as of any moment since its first logged change are the latest snapshot taken
+before that moment, plus the events that followed it, replayed. The first snapshot is of the block as it was
+before its first logged change, and every SNAPSHOT_INTERVAL events after that, a new one is compacted from
+the previous snapshot and the events since, so no replay ever goes through more than that many events.
+That is also how registrations can be rebuilt after a bad write: see `state_at`.
+
+There is only ever one snapshot of a block up to any one event, and requests racing to take the same one
+find the database turning all but the first of them down. Replaying an event only ever sets a student's state,
+so should the first snapshot happen to have a change of someone else's already in it, replaying that is harmless.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .packing import pack, unpack
+from .registrations import CHUNK_SIZE, STATES, Listener
+from .users import USER_LOOKUP_CHUNK_SIZE, fetch_user_summaries
+
+# How many events can pile up after the latest snapshot of a block before a new one is taken.
+SNAPSHOT_INTERVAL = 200
+
+
+def enabled():
+    return getattr(settings, 'MASTERCLASS_REGISTRATION_LOG', False)
+
+
+def _models():
+    from masterclass_storage.models import MasterclassRegistrationEvent, MasterclassRegistrationSnapshot
+    return MasterclassRegistrationEvent, MasterclassRegistrationSnapshot
+
+
+def day_start(day):
+    """The moment `day`, a date, begins, in the current time zone."""
+    moment = datetime.combine(day, time.min)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+def day_end(day):
+    """The moment after `day`, a date, ends, in the current time zone."""
+    return day_start(day + timedelta(days=1))
+
+
+class RegistrationLog(Listener):
+    """
+    The log as seen by one block, and the request it's handling.
+
+    `actor` is the ID of the user making the request, and `describe` is called for the first snapshot,
+    and should return a dict of the students in each state, as they are after the change being recorded.
+    """
+
+    def __init__(self, block_id, actor, describe):
+        self.block_id = block_id
+        self.actor = actor
+        self.describe = describe
+
+    def record(self, student, old_state, new_state):
+        self.record_many([student], [old_state], new_state)
+
+    def record_many(self, students, old_states, new_state):
+        """All the events of a transition_many at once, and a new snapshot if it's time for one."""
+        event_model, snapshot_model = _models()
+        latest = snapshot_model.objects.filter(block_id=self.block_id).aggregate(Max('last_event_id'))[
+            'last_event_id__max']
+        if latest is None:
+            # The block already has these changes in it, and the snapshot is of before them.
+            lists = dict((state, OrderedDict((student, True) for student in students))
+                         for state, students in self.describe().items())
+            for student, old_state in zip(students, old_states):
+                _apply(lists, student, old_state)
+            _save_snapshot(self.block_id, 0, timezone.now(),
+                           dict((state, list(lists.get(state, ()))) for state in STATES))
+            latest = 0
+        event_model.objects.bulk_create(
+            (event_model(block_id=self.block_id, student_id=student, old_state=old_state or u"",
+                         new_state=new_state or u"", actor_id=self.actor)
+             for student, old_state in zip(students, old_states)),
+            batch_size=CHUNK_SIZE)
+        if event_model.objects.filter(block_id=self.block_id, id__gt=latest).count() >= SNAPSHOT_INTERVAL:
+            take_snapshot(self.block_id)
+
+
+def _save_snapshot(block_id, last_event_id, taken, lists):
+    """Store a snapshot, unless another request got there first, in which case it's the same one."""
+    event_model, snapshot_model = _models()
+    try:
+        # A savepoint, so that a request running in a transaction of its own can go on after losing the race.
+        with transaction.atomic():
+            snapshot_model.objects.create(block_id=block_id, last_event_id=last_event_id, taken=taken,
+                                          registrations=pack(lists))
+    except IntegrityError:
+        pass
+
+
+def _apply(lists, student, new_state):
+    for students in lists.values():
+        students.pop(student, None)
+    if new_state:
+        lists[new_state][student] = True
+
+
+def _replay(block_id, until=None):
+    """
+    The registrations of the block as of the moment `until`, or now, as a dict of state -> list of student IDs,
+    along with the ID and time of the last event that went into them; or None, if the log doesn't go back that far.
+    """
+    event_model, snapshot_model = _models()
+    snapshots = snapshot_model.objects.filter(block_id=block_id)
+    if until is not None:
+        snapshots = snapshots.filter(taken__lt=until)
+    snapshot = snapshots.order_by('-last_event_id').values_list('last_event_id', 'taken', 'registrations').first()
+    if snapshot is None:
+        return None
+    last_event_id, last_time, registrations = snapshot
+    # Ordered, so that the pending list and the waitlist keep their order, and with O(1) removal.
+    lists = dict((state, OrderedDict((student, True) for student in students))
+                 for state, students in unpack(registrations).items())
+    events = event_model.objects.filter(block_id=block_id, id__gt=last_event_id)
+    if until is not None:
+        events = events.filter(created__lt=until)
+    for event_id, created, student, new_state in events.order_by('id').values_list(
+            'id', 'created', 'student_id', 'new_state').iterator():
+        _apply(lists, student, new_state)
+        last_event_id, last_time = event_id, created
+    return dict((state, list(lists[state])) for state in STATES), last_event_id, last_time
+
+
+def state_at(block_id, until=None):
+    """
+    The registrations of the block `block_id` as the log has them, as a dict of state -> list of student IDs,
+    either now, or as of the moment `until`. None if the log doesn't go back that far.
+    """
+    replayed = _replay(block_id, until)
+    return replayed[0] if replayed is not None else None
+
+
+def take_snapshot(block_id):
+    """Compact the latest snapshot of `block_id` and the events since into a new one."""
+    event_model, snapshot_model = _models()
+    replayed = _replay(block_id)
+    if replayed is not None:
+        lists, last_event_id, taken = replayed
+        _save_snapshot(block_id, last_event_id, taken, lists)
+
+
+def student_history(block_id, student):
+    """Every change of `student`'s registration for the block, oldest first, as a list of dicts."""
+    event_model, snapshot_model = _models()
+    events = list(event_model.objects.filter(block_id=block_id, student_id=student).order_by('id').values_list(
+        'created', 'old_state', 'new_state', 'actor_id'))
+    actors = fetch_user_summaries(actor for created, old_state, new_state, actor in events if actor is not None)
+    return [
+        {
+            'time': created.isoformat(),
+            'old_state': old_state or None,
+            'new_state': new_state or None,
+            'actor': actors[actor][0] if actor in actors else None,
+        }
+        for created, old_state, new_state, actor in events
+    ]
+
+
+def export_rows(block_id, since=None, until=None):
+    """
+    Yield every event of the block's log between the moments `since` and `until`, either of which can be None,
+    as a (time, username, email, name, old state, new state, actor's username) tuple, oldest first,
+    with the users looked up a chunk of events at a time.
+    """
+    event_model, snapshot_model = _models()
+    events = event_model.objects.filter(block_id=block_id)
+    if since is not None:
+        events = events.filter(created__gte=since)
+    if until is not None:
+        events = events.filter(created__lt=until)
+    events = events.order_by('id').values_list('id', 'created', 'student_id', 'old_state', 'new_state', 'actor_id')
+    last_id = 0
+    while True:
+        # Keyset pagination, so that each chunk is a cheap indexed query however far into the log it is.
+        chunk = list(events.filter(id__gt=last_id)[:USER_LOOKUP_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        users = fetch_user_summaries([row[2] for row in chunk] + [row[5] for row in chunk if row[5] is not None])
+        for event_id, created, student, old_state, new_state, actor in chunk:
+            username, email, name = users.get(student, (u"", u"", u""))
+            yield (created.isoformat(), username, email, name, old_state, new_state,
+                   users[actor][0] if actor in users else u"")
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Bookkeeping for who is registered for a master-class, and in what capacity.
+"""
+
+from itertools import islice
+
+APPROVED = 'approved'
+PENDING = 'pending'
+CANCELLED = 'cancelled'
+# Waiting, in order, for a seat to free up, when there's no approval step to wait on.
+WAITLISTED = 'waitlisted'
+
+STATES = (APPROVED, PENDING, CANCELLED, WAITLISTED)
+
+# How many students go into a single IN (...) clause or INSERT when many of them change at once.
+CHUNK_SIZE = 500
+
+# Blocks whose registration tables this process has seen seeded, which they stay for good.
+_seeded = set()
+
+
+def unique(students):
+    """`students` without repeats, in the order each first appeared."""
+    seen = set()
+    return [student for student in students if not (student in seen or seen.add(student))]
+
+
+def normalize_student_id(student):
+    """
+    A student's user ID as the integer the registrations are kept by, whether it came from the user service
+    or as a string from client JSON. Raises ValueError or TypeError if it isn't one.
+    """
+    if isinstance(student, bool):
+        raise TypeError(u"Not a user ID: {0!r}".format(student))
+    return int(student)
+
+
+class Listener(object):
+    """
+    Something that is told about every registration change, see RegistrationIndex.
+    Whatever can take all the students a transition_many moved at once for less than one at a time
+    should override `record_many`.
+    """
+
+    def record(self, student, old_state, new_state):
+        raise NotImplementedError
+
+    def record_many(self, students, old_states, new_state):
+        """`students` moved into `new_state`, each from the state in the same place in `old_states`."""
+        for student, old_state in zip(students, old_states):
+            self.record(student, old_state, new_state)
+
+
+class RegistrationIndex(object):
+    """
+    Keeps a hashed student -> state map next to the ordered registration lists of a block,
+    so that finding out where a student stands doesn't mean scanning every list.
+
+    The lists remain the stored form of the data, in their original format and order.
+    The index mutates them only through `move`, which keeps both in sync.
+
+    Every change bumps the registration version, which is handed to `on_change` to be stored,
+    and is reported to each of `listeners`, see Listener: those of a transition_many all at once,
+    and any other one by itself.
+
+    The waitlist additionally gets a student -> ticket map, where a ticket is the position in the waitlist
+    at the time the map was built, or the student joined, plus the number of students who left
+    from the head of the line since. Leaving from the head, which is what promotion does, only bumps that number,
+    so it, and joining at the tail, keep the map valid; leaving from the middle of the line has it rebuilt
+    the next time it is needed. The waitlist itself is a deque, so that leaving from the head doesn't shift
+    the rest of the line along.
+    """
+
+    def __init__(self, lists, version=0, on_change=None, listeners=()):
+        # `lists` maps each state to a list of students, and WAITLISTED to a deque, as packing.unpack makes them.
+        self.lists = lists
+        self.current_version = version
+        self.on_change = on_change
+        self.listeners = list(listeners)
+        self._states = None
+        self._tickets = None
+        self._waitlist_head = 0
+
+    @property
+    def states(self):
+        # Built on first use only, since plenty of requests never ask about any particular student.
+        if self._states is None:
+            self._states = {}
+            for state, students in self.lists.items():
+                for student in students:
+                    self._states[student] = state
+        return self._states
+
+    def __contains__(self, student):
+        return student in self.states
+
+    def state_of(self, student):
+        """Returns the state `student` is in, or None if they never registered."""
+        return self.states.get(student)
+
+    @property
+    def tickets(self):
+        if self._tickets is None:
+            self._waitlist_head = 0
+            self._tickets = dict((student, ticket) for ticket, student in enumerate(self.lists[WAITLISTED]))
+        return self._tickets
+
+    def waitlist_position(self, student):
+        """Where `student` stands in the waitlist, counting from 1, or None if they're not in it."""
+        ticket = self.tickets.get(student)
+        if ticket is None:
+            return None
+        return ticket - self._waitlist_head + 1
+
+    def version(self):
+        """A number that changes whenever any registration does."""
+        return self.current_version
+
+    def students(self, state):
+        return self.lists[state]
+
+    def count(self, state):
+        return len(self.lists[state])
+
+    def transition(self, student, state, from_states=None, capacity=None):
+        """
+        Move `student` into `state`, but only if they are currently in one of `from_states`
+        (None in there stands for "never registered"), and, when moving into APPROVED,
+        only if fewer than `capacity` students are approved already.
+        Returns True if the move happened.
+        """
+        if from_states is not None and self.state_of(student) not in from_states:
+            return False
+        if state == APPROVED and capacity is not None and self.count(APPROVED) >= capacity:
+            return False
+        self.move(student, state)
+        return True
+
+    def transition_many(self, students, state, from_states=None, capacity=None):
+        """
+        `transition` for each of `students` in turn, stopping short once `capacity` is reached.
+        Returns the list of students who were actually moved.
+        """
+        moved = []
+        changed = []
+        old_states = []
+        for student in unique(students):
+            if state == APPROVED and capacity is not None and self.count(APPROVED) >= capacity:
+                break
+            old_state = self.state_of(student)
+            if from_states is not None and old_state not in from_states:
+                continue
+            moved.append(student)
+            if self._move(student, state):
+                changed.append(student)
+                old_states.append(old_state)
+        if changed:
+            for listener in self.listeners:
+                listener.record_many(changed, old_states, state)
+        return moved
+
+    def promote(self, capacity):
+        """
+        Approve students from the head of the waitlist for as long as there are free places.
+        Returns the list of students who were approved.
+        """
+        return self.transition_many(islice(self.students(WAITLISTED), capacity), APPROVED,
+                                    from_states=(WAITLISTED,), capacity=capacity)
+
+    def _leave_waitlist(self, student):
+        waitlist = self.lists[WAITLISTED]
+        if waitlist[0] == student:
+            waitlist.popleft()
+            self._waitlist_head += 1
+            if self._tickets is not None:
+                del self._tickets[student]
+        else:
+            waitlist.remove(student)
+            self._tickets = None
+
+    def move(self, student, state):
+        """
+        Move `student` into `state`, taking them out of whatever state they were in before.
+        Passing None as the state forgets the student entirely.
+        """
+        old_state = self.states.get(student)
+        if self._move(student, state):
+            for listener in self.listeners:
+                listener.record(student, old_state, state)
+
+    def _move(self, student, state):
+        """`move` without telling the listeners. Returns whether the student was in another state."""
+        old_state = self.states.get(student)
+        if old_state == state:
+            return False
+        if old_state == WAITLISTED:
+            self._leave_waitlist(student)
+        elif old_state is not None:
+            self.lists[old_state].remove(student)
+        if state is None:
+            del self.states[student]
+        else:
+            if state == WAITLISTED and self._tickets is not None:
+                self._tickets[student] = self._waitlist_head + len(self.lists[WAITLISTED])
+            self.lists[state].append(student)
+            self.states[student] = state
+        self.current_version += 1
+        if self.on_change is not None:
+            self.on_change(self.current_version)
+        return True
+
+
+class DatabaseRegistrations(object):
+    """
+    Registration storage in dedicated database tables, one row per student, rather than in the
+    block's user_state_summary, which every request reads whole and writes back whole.
+
+    Every transition is a conditional UPDATE run while holding a row lock on the block's seat counter,
+    so concurrent requests can neither overwrite each other nor sell more seats than there are.
+    It offers the same interface as RegistrationIndex, and `listeners` get told about changes
+    once they are committed.
+
+    The first time a block is seen, the rows are seeded from what `lists` returns, the block's List fields,
+    which is only called then.
+    """
+
+    def __init__(self, block_id, lists, listeners=()):
+        from masterclass_storage.models import MasterclassRegistration, MasterclassSeats
+        self.registrations = MasterclassRegistration.objects.filter(block_id=block_id)
+        self.seats_model = MasterclassSeats
+        self.block_id = block_id
+        self.listeners = list(listeners)
+        self.states = {}
+        self._seed(lists)
+
+    @staticmethod
+    def seats(block_id):
+        """
+        How many students are approved for `block_id`, and the version of its registrations, without seeding them;
+        None if they haven't been seeded yet.
+        """
+        from masterclass_storage.models import MasterclassSeats
+        return MasterclassSeats.objects.filter(block_id=block_id).values_list('approved', 'version').first()
+
+    def _seed(self, lists):
+        from django.db import IntegrityError, transaction
+        if self.block_id in _seeded:
+            return
+        if self.seats_model.objects.filter(block_id=self.block_id).exists():
+            _seeded.add(self.block_id)
+            return
+        lists = lists()
+        try:
+            with transaction.atomic():
+                self.seats_model.objects.create(block_id=self.block_id, approved=len(set(lists[APPROVED])))
+                self.registrations.model.objects.bulk_create(
+                    self.registrations.model(block_id=self.block_id, student_id=student, state=state)
+                    for state, students in lists.items()
+                    for student in set(students)
+                )
+        except IntegrityError:
+            # Somebody else got to seed it first, which is just as good.
+            pass
+        _seeded.add(self.block_id)
+
+    def __contains__(self, student):
+        return self.state_of(student) is not None
+
+    def state_of(self, student):
+        if student not in self.states:
+            self.states[student] = self.registrations.filter(student_id=student).values_list(
+                'state', flat=True).first()
+        return self.states[student]
+
+    def version(self):
+        return self.seats_model.objects.values_list('version', flat=True).get(block_id=self.block_id)
+
+    def waitlist_position(self, student):
+        from django.db.models import Q
+        row = self.registrations.filter(student_id=student, state=WAITLISTED).values_list('changed', 'id').first()
+        if row is None:
+            return None
+        changed, pk = row
+        # An indexed count of whoever is ahead in line.
+        return self.registrations.filter(state=WAITLISTED).filter(
+            Q(changed__lt=changed) | Q(changed=changed, id__lt=pk)).count() + 1
+
+    def promote(self, capacity):
+        # transition_many checks again under the lock, and stops once the places run out.
+        heads = self.registrations.filter(state=WAITLISTED).order_by('changed', 'id').values_list(
+            'student_id', flat=True)[:capacity]
+        heads = list(heads)
+        # It's asked on every look at the page, and mostly there's nobody waiting, which needs no lock.
+        if not heads:
+            return []
+        return self.transition_many(heads, APPROVED, from_states=(WAITLISTED,), capacity=capacity)
+
+    def students(self, state):
+        return list(self.registrations.filter(state=state).order_by('changed', 'id').values_list(
+            'student_id', flat=True))
+
+    def count(self, state):
+        if state == APPROVED:
+            return self.seats_model.objects.values_list('approved', flat=True).get(block_id=self.block_id)
+        return self.registrations.filter(state=state).count()
+
+    def transition(self, student, state, from_states=None, capacity=None):
+        from django.db import transaction
+        from django.db.models import F
+        from django.utils.timezone import now
+        with transaction.atomic():
+            seats = self.seats_model.objects.select_for_update().get(block_id=self.block_id)
+            # Now that we hold the lock, nobody else can change this block's registrations under us.
+            old_state = self.registrations.filter(student_id=student).values_list('state', flat=True).first()
+            self.states[student] = old_state
+            if from_states is not None and old_state not in from_states:
+                return False
+            if old_state == state:
+                return True
+            if state == APPROVED:
+                if capacity is not None and seats.approved >= capacity:
+                    return False
+                approved = F('approved') + 1
+            elif old_state == APPROVED:
+                approved = F('approved') - 1
+            else:
+                approved = F('approved')
+            self.seats_model.objects.filter(pk=seats.pk).update(approved=approved, version=F('version') + 1)
+            if old_state is None:
+                self.registrations.create(block_id=self.block_id, student_id=student, state=state)
+            elif state is None:
+                self.registrations.filter(student_id=student).delete()
+            else:
+                # update() bypasses auto_now, and "changed" is what keeps the application order.
+                self.registrations.filter(student_id=student).update(state=state, changed=now())
+            self.states[student] = state
+        for listener in self.listeners:
+            listener.record(student, old_state, state)
+        return True
+
+    def transition_many(self, students, state, from_states=None, capacity=None):
+        """
+        All of `students` at once, under one lock, with one UPDATE for those who have registered before,
+        and one INSERT for those who haven't.
+        """
+        from django.db import transaction
+        from django.db.models import F
+        from django.utils.timezone import now
+        # A student in there twice would be counted twice against the seats, but only have the one row.
+        students = unique(students)
+        with transaction.atomic():
+            seats = self.seats_model.objects.select_for_update().get(block_id=self.block_id)
+            current = {}
+            for start in range(0, len(students), CHUNK_SIZE):
+                current.update(self.registrations.filter(student_id__in=students[start:start + CHUNK_SIZE]).values_list(
+                    'student_id', 'state'))
+            # Whoever asks next about any of these gets the answer for free.
+            self.states.update((student, current.get(student)) for student in students)
+            # Keep the order we were given, it's the order of preference.
+            moved = [student for student in students
+                     if current.get(student) != state
+                     and (from_states is None or current.get(student) in from_states)]
+            if state == APPROVED and capacity is not None:
+                moved = moved[:max(capacity - seats.approved, 0)]
+            if not moved:
+                return []
+            leaving_approved = len([student for student in moved if current.get(student) == APPROVED])
+            approved = F('approved') - leaving_approved
+            if state == APPROVED:
+                approved += len(moved)
+            existing = [student for student in moved if student in current]
+            for start in range(0, len(existing), CHUNK_SIZE):
+                self.registrations.filter(student_id__in=existing[start:start + CHUNK_SIZE]).update(
+                    state=state, changed=now())
+            self.registrations.model.objects.bulk_create(
+                (self.registrations.model(block_id=self.block_id, student_id=student, state=state)
+                 for student in moved if student not in current),
+                batch_size=CHUNK_SIZE)
+            self.seats_model.objects.filter(pk=seats.pk).update(approved=approved, version=F('version') + 1)
+        for student in moved:
+            self.states[student] = state
+        for listener in self.listeners:
+            listener.record_many(moved, [current.get(student) for student in moved], state)
+        return moved
+
+    def move(self, student, state):
+        self.transition(student, state)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide cache of our static resources and the Django templates compiled from them.
+
+Both are loaded lazily, the first time anyone asks for them, and then kept for the life of the process.
+Set MASTERCLASS_RELOAD_RESOURCES to True in Django settings to have a resource reloaded
+whenever its file changes, which is handy while working on the templates.
+"""
+
+import os
+import threading
+
+import pkg_resources
+
+from django.conf import settings
+from django.template import Template as DjangoTemplate
+
+_resources = {}
+_templates = {}
+_lock = threading.Lock()
+
+
+def _mtime(path):
+    if not getattr(settings, 'MASTERCLASS_RELOAD_RESOURCES', False):
+        return None
+    try:
+        return os.path.getmtime(pkg_resources.resource_filename(__name__, path))
+    except (OSError, NotImplementedError):
+        # Zipped eggs and such don't have files to check.
+        return None
+
+
+def _cached(cache, path, load):
+    mtime = _mtime(path)
+    entry = cache.get(path)
+    if entry is None or entry[0] != mtime:
+        value = load(path)
+        with _lock:
+            cache[path] = entry = (mtime, value)
+    return entry[1]
+
+
+def _load_resource(path):
+    return pkg_resources.resource_string(__name__, path).decode("utf8")
+
+
+def _load_template(path):
+    return DjangoTemplate(resource_string(path))
+
+
+def resource_string(path):
+    """The decoded contents of the resource at `path`."""
+    return _cached(_resources, path, _load_resource)
+
+
+def template(path):
+    """The compiled Django template in the resource at `path`."""
+    return _cached(_templates, path, _load_template)
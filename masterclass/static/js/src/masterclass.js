@@ -2,18 +2,127 @@
 function MasterclassXBlock(runtime, element) {
 
     $('.masterclass-get-csv-link', element).attr('href', runtime.handlerUrl(element, 'get_csv'));
+    $('.masterclass-get-all-csv-link', element).attr('href', runtime.handlerUrl(element, 'get_csv', '', 'state=all'));
 
-    $.ajax({
-        type: "POST",
-        url: runtime.handlerUrl(element, 'refresh_display'),
-        data: JSON.stringify({"display_refreshed": "True"}),
-        success: updateStatus
-    });
+    // The status handler answers 304 when nothing changed since the ETag we got last.
+    var statusETag = null;
+    // Polling is off unless the server sets an interval, in seconds. While nothing changes,
+    // the interval keeps doubling up to maxPollBackoff times the original, and drops back once something does.
+    var pollInterval = Number($('.masterclass_block', element).data('poll-interval')) * 1000;
+    var maxPollBackoff = 8;
+    var pollBackoff = 1;
+
+    function refreshStatus() {
+        $.ajax({
+            type: "GET",
+            url: runtime.handlerUrl(element, 'status'),
+            headers: statusETag ? {"If-None-Match": statusETag} : {},
+            success: function (result, textStatus, xhr) {
+                if (xhr.status == 304) {
+                    pollBackoff = Math.min(pollBackoff * 2, maxPollBackoff);
+                    return;
+                }
+                pollBackoff = 1;
+                statusETag = xhr.getResponseHeader("ETag");
+                updateStatus(result);
+            },
+            complete: schedulePoll
+        });
+    }
+
+    // With push on, the server tells us when something changes, and polling is off.
+    var pushEnabled = Boolean($('.masterclass_block', element).data('push'));
+
+    function schedulePoll() {
+        // Until registration opens, the countdown is all that changes, and it's kept here.
+        if (pollInterval > 0 && !countdownTimer && !pushEnabled) {
+            setTimeout(refreshStatus, pollInterval * pollBackoff);
+        }
+    }
+
+    // Registration opens at this moment by the local clock, worked out from how many seconds away the server
+    // said it was, so that the countdown doesn't depend on the local clock being right.
+    var opensAt = null;
+    var countdownTimer = null;
+
+    function pad(number) {
+        return (number < 10 ? "0" : "") + number;
+    }
+
+    function tick() {
+        var left = Math.ceil((opensAt - Date.now()) / 1000);
+        if (left > 0) {
+            var days = Math.floor(left / 86400);
+            $('.masterclass-countdown', element).text("До открытия приема заявок: " +
+                (days ? days + " д. " : "") + pad(Math.floor(left % 86400 / 3600)) + ":" +
+                pad(Math.floor(left % 3600 / 60)) + ":" + pad(left % 60));
+            return;
+        }
+        clearInterval(countdownTimer);
+        countdownTimer = null;
+        $('.masterclass-countdown', element).text("");
+        $('.register_button', element).prop('disabled', false);
+        // Spread the status requests of everyone watching over a couple of seconds, rather than all at once.
+        statusETag = null;
+        setTimeout(refreshStatus, Math.random() * 2000);
+    }
+
+    function startCountdown(seconds) {
+        opensAt = Date.now() + seconds * 1000;
+        $('.register_button', element).prop('disabled', true);
+        if (!countdownTimer) {
+            countdownTimer = setInterval(tick, 1000);
+        }
+        tick();
+    }
+
+    var opensIn = Number($('.masterclass_block', element).data('opens-in'));
+    if (opensIn > 0) {
+        startCountdown(opensIn);
+    }
+    refreshStatus();
+
+    // Every answer comes either with a change, or after a few seconds of waiting for one, and either way
+    // we ask again straight away. If it fails, we wait a while, a random while, so that a server coming back up
+    // doesn't get everyone at once.
+    function listenForUpdates(after) {
+        $.ajax({
+            type: "GET",
+            url: runtime.handlerUrl(element, 'updates', '', after === null ? '' : 'after=' + after),
+            success: function (result) {
+                if (result.seq === null) {
+                    // The server can't keep track of changes, so it's back to polling.
+                    pushEnabled = false;
+                    schedulePoll();
+                    return;
+                }
+                if (result.status) {
+                    statusETag = null;
+                    updateStatus(result.status);
+                }
+                listenForUpdates(result.seq);
+            },
+            error: function () {
+                setTimeout(function () {
+                    listenForUpdates(after);
+                }, 5000 + Math.random() * 5000);
+            }
+        });
+    }
+
+    if (pushEnabled) {
+        listenForUpdates(null);
+    }
 
     function updateStatus(result) {
         $('.registration_status', element).text(result.registration_status);
         $('.register_button .register_button_label', element).text(result.button_text);
-        $('.capacity', element).text(result.free_places + " / " + result.capacity);
+        if (result.capacity !== undefined) {
+            $('.capacity', element).text(result.free_places + " / " + result.capacity);
+        }
+        if (result.opens_in > 0) {
+            startCountdown(result.opens_in);
+        }
     }
 
     $('.register_button', element).click(function (eventObject) {
@@ -24,22 +133,97 @@ function MasterclassXBlock(runtime, element) {
             type: "POST",
             url: handlerUrl,
             data: JSON.stringify({"button_clicked": "True"}),
-            success: updateStatus
+            success: function (result) {
+                // Whatever we knew is out of date now.
+                statusETag = null;
+                pollBackoff = 1;
+                updateStatus(result);
+            }
         });
     });
 
-    function updateStudents(result) {
-        window.location.reload();
+    // Staff rosters are loaded a page at a time, and only the affected rows change after an approval.
+    function loadRoster(roster, page) {
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'roster'),
+            data: JSON.stringify({
+                "state": roster.data('state'),
+                "page": page,
+                "search": $('.masterclass-roster-search', roster).val()
+            }),
+            success: function (result) {
+                renderRoster(roster, result);
+            }
+        });
+    }
 
-        /*if (result.free_places > 0) {
-            $(element).find('.student_approval_button[data-student="' + result.student_id + '"]').remove();
-        } else {
-            $(element).find('.student_approval_button').remove();
+    function renderRoster(roster, result) {
+        if (result.status != "ok") {
+            return;
         }
-        $(element).find('.capacity').text(result.free_places + " / " + result.capacity);*/
+        roster.data('page', result.page);
+        var list = $('.masterclass-student-list', roster).empty();
+        $.each(result.students, function (index, student) {
+            var item = $('<li class="student"></li>').text(student.name + " (" + student.email + ")");
+            if (result.state == "pending" && result.free_places > 0) {
+                item.prepend($('<input type="checkbox" class="masterclass-select-student"/>')
+                    .attr('data-student', student.id));
+                item.append($('<button class="student_approval_button masterclass-button">Одобрить</button>')
+                    .attr('data-student', student.id));
+            }
+            list.append(item);
+        });
+        $('.masterclass-roster-page', roster).text(result.page + " / " + result.pages);
+        $('.masterclass-roster-prev', roster).prop('disabled', result.page <= 1);
+        $('.masterclass-roster-next', roster).prop('disabled', result.page >= result.pages);
+        $('.masterclass-roster-pager', roster).toggle(result.pages > 1);
+        $('.masterclass-select-all', roster).prop('checked', false);
+        $('.masterclass-bulk-approval', roster).toggle(result.state == "pending" && result.free_places > 0);
     }
 
-    $('.student_approval_button', element).click(function (eventObject) {
+    $('.masterclass-roster', element).each(function () {
+        var roster = $(this);
+        var searchTimer = null;
+        loadRoster(roster, 1);
+        $('.masterclass-roster-prev', roster).click(function () {
+            loadRoster(roster, roster.data('page') - 1);
+        });
+        $('.masterclass-roster-next', roster).click(function () {
+            loadRoster(roster, roster.data('page') + 1);
+        });
+        $('.masterclass-roster-search', roster).on('input', function () {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(function () {
+                loadRoster(roster, 1);
+            }, 300);
+        });
+    });
+
+    function updateStudents(result) {
+        if (result.capacity === undefined) {
+            return;
+        }
+        if (result.status != "fail") {
+            var approvedIds = result.student_ids || [result.student_id];
+            $.each(approvedIds, function (index, student_id) {
+                $('.student_approval_button[data-student="' + student_id + '"]', element).closest('li').remove();
+            });
+        }
+        if (result.free_places <= 0) {
+            $('.student_approval_button, .masterclass-select-student, .masterclass-bulk-approval', element).remove();
+        }
+        $('.capacity', element).text(result.free_places + " / " + result.capacity);
+        var approved = $('.masterclass-roster[data-state="approved"]', element);
+        loadRoster(approved, approved.data('page') || 1);
+        if (result.status == "fail") {
+            // What we showed was out of date, so show what there is now.
+            var pending = $('.masterclass-roster[data-state="pending"]', element);
+            loadRoster(pending, pending.data('page') || 1);
+        }
+    }
+
+    $(element).on('click', '.student_approval_button', function (eventObject) {
         var handlerUrl = runtime.handlerUrl(element, 'approval_button');
         var student_id = $(this).data('student');
         $.ajax({
@@ -50,15 +234,203 @@ function MasterclassXBlock(runtime, element) {
         });
     });
 
+    $('.masterclass-select-all', element).change(function (eventObject) {
+        $('.masterclass-select-student', $(this).closest('.masterclass-roster')).prop('checked', this.checked);
+    });
+
+    $('.masterclass-approve-selected', element).click(function (eventObject) {
+        var student_ids = $('.masterclass-select-student:checked', element).map(function () {
+            return $(this).data('student');
+        }).get();
+        if (!student_ids.length) {
+            return;
+        }
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'bulk_approval'),
+            data: JSON.stringify({"student_ids": student_ids}),
+            success: updateStudents
+        });
+    });
+
+    var importResults = {
+        "not_found": "пользователь не найден",
+        "duplicate": "повторяется",
+        "already_registered": "уже зарегистрирован",
+        "no_places": "не хватило мест"
+    };
+
+    $('.masterclass-import-button', element).click(function (eventObject) {
+        $('.masterclass-import', element).slideToggle();
+    });
+
+    function renderImport(result) {
+        if (result.status != "ok") {
+            $('.masterclass-import-status', element).text("Не удалось прочитать список.");
+            return;
+        }
+        $('.masterclass-import-status', element).text("Зарегистрировано слушателей: " + result.registered + ".");
+        var problems = $('.masterclass-import-problems', element).empty();
+        $.each(result.rows, function (index, row) {
+            problems.append($('<li></li>').text(
+                "Строка " + row.row + ", " + row.student + ": " + (importResults[row.result] || row.result)));
+        });
+        $('.capacity', element).text(result.free_places + " / " + result.capacity);
+        var approved = $('.masterclass-roster[data-state="approved"]', element);
+        if (approved.length) {
+            loadRoster(approved, approved.data('page') || 1);
+        }
+    }
+
+    $('.masterclass-import-submit', element).click(function (eventObject) {
+        var file = $('.masterclass-import-file', element)[0].files[0];
+        if (!file) {
+            return;
+        }
+        var data = new FormData();
+        data.append("file", file);
+        $('.masterclass-import-status', element).text("Идет регистрация...");
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'import_roster'),
+            data: data,
+            processData: false,
+            contentType: false,
+            success: renderImport
+        });
+    });
+
+    var stateNames = {
+        "approved": "зарегистрирован",
+        "pending": "ожидает одобрения",
+        "waitlisted": "в очереди",
+        "cancelled": "отменил заявку"
+    };
+
+    function loadCourseDashboard() {
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'course_dashboard'),
+            data: JSON.stringify({"student": $('.masterclass-course-dashboard-student', element).val()}),
+            success: renderCourseDashboard
+        });
+    }
+
+    function renderCourseDashboard(result) {
+        if (result.status != "ok") {
+            return;
+        }
+        var table = $('.masterclass-course-dashboard-table tbody', element).empty();
+        $.each(result.blocks, function (index, block) {
+            table.append($('<tr></tr>').append(
+                $('<td></td>').text(block.display_name),
+                $('<td></td>').text(block.approved + " / " + block.capacity),
+                $('<td></td>').text(block.pending),
+                $('<td></td>').text(block.waitlisted),
+                $('<td></td>').text(block.cancelled)
+            ));
+        });
+        var registrations = $('.masterclass-course-dashboard-registrations', element).empty();
+        if (result.student) {
+            $.each(result.student.registrations, function (index, registration) {
+                registrations.append($('<li></li>').text(
+                    registration.display_name + ": " + (stateNames[registration.state] || registration.state)));
+            });
+        }
+    }
+
+    $('.masterclass-course-dashboard-csv-link', element).attr('href',
+        runtime.handlerUrl(element, 'course_dashboard_csv'));
+
+    $('.masterclass-course-dashboard-button', element).click(function (eventObject) {
+        var dashboard = $('.masterclass-course-dashboard', element);
+        if (!dashboard.is(':visible')) {
+            loadCourseDashboard();
+        }
+        dashboard.slideToggle();
+    });
+
+    $('.masterclass-course-dashboard-student', element).change(loadCourseDashboard);
+
+    function registrationLogUrl() {
+        return runtime.handlerUrl(element, 'registration_log_csv', '', $.param({
+            "since": $('.masterclass-registration-log-since', element).val(),
+            "until": $('.masterclass-registration-log-until', element).val()
+        }));
+    }
+
+    $('.masterclass-registration-log-csv-link', element).attr('href', registrationLogUrl());
+
+    $('.masterclass-registration-log-since, .masterclass-registration-log-until', element).change(function () {
+        $('.masterclass-registration-log-csv-link', element).attr('href', registrationLogUrl());
+    });
+
+    $('.masterclass-registration-log-button', element).click(function (eventObject) {
+        $('.masterclass-registration-log', element).slideToggle();
+    });
+
+    function renderRegistrationHistory(result) {
+        var history = $('.masterclass-registration-log-history', element).empty();
+        if (result.status != "ok") {
+            history.append($('<li></li>').text("Слушатель не найден."));
+            return;
+        }
+        if (!result.history.length) {
+            history.append($('<li></li>').text("Слушатель " + result.username + " не подавал заявок."));
+        }
+        $.each(result.history, function (index, event) {
+            history.append($('<li></li>').text(
+                new Date(event.time).toLocaleString() + ": " +
+                (stateNames[event.old_state] || "не зарегистрирован") + " → " +
+                (stateNames[event.new_state] || "не зарегистрирован") +
+                (event.actor ? " (" + event.actor + ")" : "")));
+        });
+    }
+
+    $('.masterclass-registration-log-student', element).change(function (eventObject) {
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'registration_history'),
+            data: JSON.stringify({"student": $(this).val()}),
+            success: renderRegistrationHistory
+        });
+    });
+
     $('.send-mail-button', element).click(function (eventObject) {
         $('.send-mail-wrapper', element).slideToggle();
     });
 
+    function showMailProgress(result) {
+        if (result.status != "ok") {
+            return;
+        }
+        $('.send-mail-status', element).text("Отправлено писем: " + result.sent + " из " + result.total +
+            (result.failed ? ", не удалось отправить: " + result.failed : "") + ".");
+        if (!result.done) {
+            setTimeout(function () {
+                pollMailProgress(result.job_id);
+            }, 2000);
+        }
+    }
+
+    function pollMailProgress(job_id) {
+        $.ajax({
+            type: "POST",
+            url: runtime.handlerUrl(element, 'email_job_status'),
+            data: JSON.stringify({"job_id": job_id}),
+            success: showMailProgress
+        });
+    }
+
     function mailSent(result) {
         $('.send-mail-wrapper', element).slideToggle();
         $('.send-mail-spin', element).remove();
         $('input#email_subject', element).val('');
         $('textarea#email_content',element).val('');
+        if (result.job_id) {
+            $('.send-mail-status', element).text("Письма поставлены в очередь на отправку.");
+            pollMailProgress(result.job_id);
+        }
     }
 
     $('.send-mail-submit', element).click(function (eventObject) {
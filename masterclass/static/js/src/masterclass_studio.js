@@ -20,6 +20,9 @@ function MasterclassXBlockStudio(runtime, element) {
                 return x;
             } else return "";
         },
+        'datetime_string': function (x) {
+            return /^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$/.test($.trim(x)) ? $.trim(x) : "";
+        },
         'boolean': function (x) {
             return ["true", "yes", "1", "no", "false", "0"].indexOf(x.toLowerCase()) >= 0;
         }
@@ -38,7 +41,11 @@ function MasterclassXBlockStudio(runtime, element) {
             type: "POST",
             url: saveUrl,
             data: JSON.stringify(data),
-            success: function() {
+            success: function(result) {
+                if (result && result.status == "fail") {
+                    view.runtime.notify('error', {title: "Настройки не сохранены", message: result.message});
+                    return;
+                }
                 view.runtime.notify('save', {state: 'end'});
             }
         });
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Email delivery for master-classes, out of the web request.
+
+Recipients are split into batches, each batch is sent over its own SMTP connection and retried
+if it fails, and the progress of the whole job is kept in the Django cache under a job ID.
+Batches go to a small thread pool in this process by default, which is good enough for devstack,
+the workbench, and a course's worth of mail, or to Celery, if set up for it.
+
+The Celery workers only know the task if they import this module, and "masterclass" can't be
+in INSTALLED_APPS for them to find it by themselves, so using Celery takes both of these in the LMS settings:
+
+    MASTERCLASS_EMAIL_QUEUE = "celery"
+    CELERY_IMPORTS += ("masterclass.tasks",)
+
+Settings:
+    MASTERCLASS_EMAIL_QUEUE -- "thread" or "celery", "thread" by default.
+    MASTERCLASS_EMAIL_BATCH_SIZE -- how many messages go through one SMTP connection.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import six
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+
+from .emails import MessageBuilder
+from .users import fetch_users
+
+try:
+    from opaque_keys.edx.keys import CourseKey
+except:
+    # Studio, see the same thing in masterclass.py.
+    pass
+
+try:
+    from celery import task
+except ImportError:
+    task = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+MAX_RETRIES = 3
+RETRY_DELAY = 30
+THREAD_POOL_SIZE = 2
+
+# Long enough for anyone to still be looking at the progress of a job.
+JOB_TIMEOUT = 60 * 60 * 24
+
+# How many jobs' message builders a process holds on to, so that every batch of a job after the first
+# doesn't have to look up the course and render the template again.
+BUILDER_CACHE_SIZE = 8
+
+_thread_pool = None
+
+_builders = OrderedDict()
+_builders_lock = threading.Lock()
+
+
+def _job_key(job_id, counter):
+    return 'masterclass.email_job.{0}.{1}'.format(job_id, counter)
+
+
+def job_progress(job_id):
+    """
+    Returns a dict with the total number of messages in the job, and how many were sent or failed so far,
+    or None if there is no such job (or it has expired).
+    """
+    keys = [_job_key(job_id, counter) for counter in ('total', 'sent', 'failed')]
+    values = cache.get_many(keys)
+    total = values.get(keys[0])
+    if total is None:
+        return None
+    sent = values.get(keys[1], 0)
+    failed = values.get(keys[2], 0)
+    return {
+        'job_id': job_id,
+        'total': total,
+        'sent': sent,
+        'failed': failed,
+        'done': sent + failed >= total,
+    }
+
+
+def _count(job_id, counter, amount):
+    # Batches finish concurrently, so the counters are only ever touched through incr, which is atomic.
+    cache.incr(_job_key(job_id, counter), amount)
+
+
+def _message_builder(job_id, course_id, subject, text):
+    with _builders_lock:
+        builder = _builders.get(job_id)
+    if builder is None:
+        # Two batches of the same job may both end up building one, which is harmless.
+        builder = MessageBuilder(course_id, subject, text)
+        with _builders_lock:
+            _builders[job_id] = builder
+            while len(_builders) > BUILDER_CACHE_SIZE:
+                _builders.popitem(last=False)
+    return builder
+
+
+def compose_messages(job_id, course_id, student_ids, subject, text):
+    """
+    Make the email for every student in `student_ids` with the course email template.
+    """
+    builder = _message_builder(job_id, course_id, subject, text)
+    return [builder.message(user) for user in fetch_users(student_ids).values()]
+
+
+def send_batch(job_id, course_id, student_ids, subject, text):
+    """Send one batch of messages over a single SMTP connection."""
+    emails = compose_messages(job_id, course_id, student_ids, subject, text)
+    mail_connection = mail.get_connection()
+    sent = mail_connection.send_messages(emails) or 0
+    _count(job_id, 'sent', sent)
+    # Whoever we didn't find, or the backend refused without raising, isn't getting anything.
+    if len(student_ids) > sent:
+        _count(job_id, 'failed', len(student_ids) - sent)
+
+
+if task is not None:
+    @task(bind=True, max_retries=MAX_RETRIES, default_retry_delay=RETRY_DELAY)
+    def send_batch_task(self, job_id, course_id, student_ids, subject, text):
+        try:
+            send_batch(job_id, CourseKey.from_string(course_id), student_ids, subject, text)
+        except Exception as exc:
+            if self.request.retries >= MAX_RETRIES:
+                log.exception("Giving up on a batch of master-class email for job %s", job_id)
+                _count(job_id, 'failed', len(student_ids))
+                return
+            raise self.retry(exc=exc)
+
+
+def _send_batch_in_thread(job_id, course_id, student_ids, subject, text):
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                send_batch(job_id, course_id, student_ids, subject, text)
+                return
+            except Exception:
+                if attempt == MAX_RETRIES:
+                    log.exception("Giving up on a batch of master-class email for job %s", job_id)
+                    _count(job_id, 'failed', len(student_ids))
+                    return
+                time.sleep(RETRY_DELAY)
+    finally:
+        # This thread got its own database connection, which nobody else is going to close.
+        connection.close()
+
+
+def _queue_backend():
+    backend = getattr(settings, 'MASTERCLASS_EMAIL_QUEUE', 'thread')
+    if backend == 'celery' and task is None:
+        log.warning("MASTERCLASS_EMAIL_QUEUE is \"celery\", but Celery is not installed, "
+                    "so master-class email is sent from threads instead.")
+        return 'thread'
+    return backend
+
+
+def queue_email(course_id, student_ids, subject, text):
+    """
+    Queue `subject` and `text` to be sent to every student in `student_ids`, and return at once.
+    Returns the job ID to ask `job_progress` about.
+    """
+    global _thread_pool
+
+    student_ids = list(set(student_ids))
+    batch_size = getattr(settings, 'MASTERCLASS_EMAIL_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    job_id = uuid.uuid4().hex
+
+    cache.set_many({
+        _job_key(job_id, 'total'): len(student_ids),
+        _job_key(job_id, 'sent'): 0,
+        _job_key(job_id, 'failed'): 0,
+    }, JOB_TIMEOUT)
+
+    use_celery = _queue_backend() == 'celery'
+    if not use_celery and _thread_pool is None:
+        _thread_pool = ThreadPool(THREAD_POOL_SIZE)
+
+    for start in range(0, len(student_ids), batch_size):
+        batch = student_ids[start:start + batch_size]
+        if use_celery:
+            send_batch_task.delay(job_id, six.text_type(course_id), batch, subject, text)
+        else:
+            _thread_pool.apply_async(_send_batch_in_thread, (job_id, course_id, batch, subject, text))
+
+    return job_id
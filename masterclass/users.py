@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Looking up the users behind the student IDs we keep.
+"""
+
+from itertools import islice
+
+from django.contrib.auth.models import User
+
+# How many user IDs go into a single IN (...) clause when we fetch registrants in bulk.
+# SQLite, at least, refuses queries with more than 999 parameters.
+USER_LOOKUP_CHUNK_SIZE = 500
+
+
+def fetch_users(student_ids):
+    """
+    Fetch all the users in `student_ids`, profiles included, in as few queries as we can get away with.
+    Returns a dict of User objects keyed by user ID. Users that no longer exist are simply absent from it.
+    """
+    student_ids = list(set(student_ids))
+    users = {}
+    for start in range(0, len(student_ids), USER_LOOKUP_CHUNK_SIZE):
+        chunk = student_ids[start:start + USER_LOOKUP_CHUNK_SIZE]
+        for user in User.objects.select_related('profile').filter(id__in=chunk):
+            users[user.id] = user
+    return users
+
+
+def iter_users(student_ids):
+    """
+    Yield (student ID, User) pairs for `student_ids`, in the same order, one chunked query at a time,
+    so that only a chunk's worth of users is ever held in memory. Users that no longer exist are skipped.
+    """
+    student_ids = list(student_ids)
+    for start in range(0, len(student_ids), USER_LOOKUP_CHUNK_SIZE):
+        chunk = student_ids[start:start + USER_LOOKUP_CHUNK_SIZE]
+        users = fetch_users(chunk)
+        for student in chunk:
+            user = users.get(student)
+            if user is not None:
+                yield student, user
+
+
+def fetch_user_summaries(student_ids):
+    """
+    Like fetch_users, but only gets the username, email and full name of every user, without making
+    model instances, which is a lot lighter when all we want is to list them.
+    Returns a dict of (username, email, name) tuples keyed by user ID.
+    """
+    student_ids = list(set(student_ids))
+    summaries = {}
+    for start in range(0, len(student_ids), USER_LOOKUP_CHUNK_SIZE):
+        chunk = student_ids[start:start + USER_LOOKUP_CHUNK_SIZE]
+        for user_id, username, email, name in User.objects.filter(id__in=chunk).values_list(
+                'id', 'username', 'email', 'profile__name'):
+            summaries[user_id] = (username, email, name or u"")
+    return summaries
+
+
+def resolve_users(identifiers):
+    """
+    Yield (identifier, user ID) pairs for every username or email in `identifiers`, in the same order,
+    looking them up a chunk at a time, so that `identifiers` can be a stream of any length.
+    The user ID is None for identifiers that match nobody.
+    """
+    identifiers = iter(identifiers)
+    while True:
+        chunk = list(islice(identifiers, USER_LOOKUP_CHUNK_SIZE))
+        if not chunk:
+            return
+        emails = [identifier for identifier in chunk if u"@" in identifier]
+        found = {}
+        if emails:
+            found.update((email, user_id) for user_id, email in User.objects.filter(
+                email__in=emails).values_list('id', 'email'))
+        # Usernames may have an @ in them too, and a username that matches wins.
+        found.update((username, user_id) for user_id, username in User.objects.filter(
+            username__in=chunk).values_list('id', 'username'))
+        for identifier in chunk:
+            yield identifier, found.get(identifier)
@@ -0,0 +1,3 @@
+"""
+Database tables for the masterclass XBlock, as a Django app, see models.py.
+"""
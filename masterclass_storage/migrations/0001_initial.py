@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterclassRegistration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('block_id', models.CharField(max_length=255, db_index=True)),
+                ('student_id', models.IntegerField()),
+                ('state', models.CharField(max_length=16)),
+                ('changed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MasterclassSeats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('block_id', models.CharField(unique=True, max_length=255)),
+                ('approved', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='masterclassregistration',
+            unique_together=set([('block_id', 'student_id')]),
+        ),
+    ]
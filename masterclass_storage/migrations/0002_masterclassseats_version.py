@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masterclassseats',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0002_masterclassseats_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='masterclassregistration',
+            index_together=set([('block_id', 'state', 'changed')]),
+        ),
+    ]
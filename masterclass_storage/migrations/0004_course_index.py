@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0003_registration_state_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterclassCourseBlock',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255, db_index=True)),
+                ('block_id', models.CharField(unique=True, max_length=255)),
+                ('display_name', models.CharField(max_length=255, blank=True)),
+                ('capacity', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MasterclassCourseRegistration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('block_id', models.CharField(max_length=255)),
+                ('student_id', models.IntegerField()),
+                ('state', models.CharField(max_length=16)),
+                ('changed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='masterclasscourseregistration',
+            unique_together=set([('block_id', 'student_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='masterclasscourseregistration',
+            index_together=set([('course_id', 'student_id'), ('course_id', 'block_id', 'state')]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0004_course_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterclassRegistrationEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('block_id', models.CharField(max_length=255)),
+                ('student_id', models.IntegerField()),
+                ('old_state', models.CharField(max_length=16, blank=True)),
+                ('new_state', models.CharField(max_length=16, blank=True)),
+                ('actor_id', models.IntegerField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MasterclassRegistrationSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('block_id', models.CharField(max_length=255)),
+                ('last_event_id', models.IntegerField()),
+                ('taken', models.DateTimeField()),
+                ('registrations', models.TextField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='masterclassregistrationevent',
+            index_together=set([('block_id', 'student_id'), ('block_id', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='masterclassregistrationsnapshot',
+            index_together=set([('block_id', 'last_event_id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def drop_duplicate_snapshots(apps, schema_editor):
+    # Racing requests could store the same snapshot twice, and only one of each can stay.
+    snapshot_model = apps.get_model('masterclass_storage', 'MasterclassRegistrationSnapshot')
+    seen = set()
+    duplicates = []
+    for pk, block_id, last_event_id in snapshot_model.objects.order_by('id').values_list(
+            'id', 'block_id', 'last_event_id').iterator():
+        if (block_id, last_event_id) in seen:
+            duplicates.append(pk)
+        seen.add((block_id, last_event_id))
+    snapshot_model.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0005_registration_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_snapshots, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='masterclassregistrationsnapshot',
+            unique_together=set([('block_id', 'last_event_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='masterclassregistrationsnapshot',
+            index_together=set([]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterclass_storage', '0006_unique_snapshots'),
+    ]
+
+    operations = [
+        # Every block already there is indexed again on its next use, which also repairs those whose row
+        # a Studio save created without any of their registrations.
+        migrations.AddField(
+            model_name='masterclasscourseblock',
+            name='indexed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
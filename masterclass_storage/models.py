@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Database tables for keeping registrations outside of the XBlock field storage.
+
+These are only used when `MASTERCLASS_REGISTRATION_BACKEND` is set to "database" in Django settings,
+or the course index or the registration log are turned on, all of which require "masterclass_storage"
+to be in INSTALLED_APPS and its migrations applied.
+They live in a package of their own so that Django can load them without importing the XBlock,
+which needs Django, and edX, to be fully loaded first.
+"""
+
+from django.db import models
+
+
+class MasterclassSeats(models.Model):
+    """
+    One row per master-class block. Doubles as the lock that serializes registration changes
+    for that block, and keeps the count of approved students so we never need to count rows.
+    """
+    block_id = models.CharField(max_length=255, unique=True)
+    approved = models.IntegerField(default=0)
+    version = models.IntegerField(default=0)
+
+
+class MasterclassRegistration(models.Model):
+    """One row per student who has ever registered for a master-class block."""
+    block_id = models.CharField(max_length=255, db_index=True)
+    student_id = models.IntegerField()
+    state = models.CharField(max_length=16)
+    changed = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        unique_together = (('block_id', 'student_id'),)
+        # For listing a state in order, and counting who's ahead in the waitlist.
+        index_together = (('block_id', 'state', 'changed'),)
+
+
+class MasterclassCourseBlock(models.Model):
+    """One row per master-class block in the course-wide registration index."""
+    course_id = models.CharField(max_length=255, db_index=True)
+    block_id = models.CharField(max_length=255, unique=True)
+    display_name = models.CharField(max_length=255, blank=True)
+    capacity = models.IntegerField(default=0)
+    # Whether the block's registrations have been copied in whole. Until then, they're not to be trusted.
+    indexed = models.BooleanField(default=False)
+
+
+class MasterclassCourseRegistration(models.Model):
+    """
+    One row per student per master-class block in the course-wide registration index,
+    a copy of the registrations of all the blocks of a course, kept up to date as they change.
+    """
+    course_id = models.CharField(max_length=255)
+    block_id = models.CharField(max_length=255)
+    student_id = models.IntegerField()
+    state = models.CharField(max_length=16)
+    changed = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        unique_together = (('block_id', 'student_id'),)
+        index_together = (('course_id', 'student_id'), ('course_id', 'block_id', 'state'))
+
+
+class MasterclassRegistrationEvent(models.Model):
+    """
+    One change of one student's registration for a master-class block, in the append-only registration log.
+    An empty state stands for "not registered".
+    """
+    block_id = models.CharField(max_length=255)
+    student_id = models.IntegerField()
+    old_state = models.CharField(max_length=16, blank=True)
+    new_state = models.CharField(max_length=16, blank=True)
+    # Whoever made the request that caused the change, if anybody.
+    actor_id = models.IntegerField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        index_together = (('block_id', 'student_id'), ('block_id', 'created'))
+
+
+class MasterclassRegistrationSnapshot(models.Model):
+    """
+    The registrations of a master-class block as of one event of the registration log,
+    packed the way the block packs them, see masterclass/packing.py.
+    """
+    block_id = models.CharField(max_length=255)
+    last_event_id = models.IntegerField()
+    # When that event happened.
+    taken = models.DateTimeField()
+    registrations = models.TextField()
+
+    class Meta(object):
+        # Two requests racing to take the same snapshot would otherwise both store it.
+        unique_together = (('block_id', 'last_event_id'),)
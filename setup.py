@@ -26,6 +26,8 @@ setup(
     description='masterclass XBlock',   # TODO: write a better description.
     packages=[
         'masterclass',
+        'masterclass_storage',
+        'masterclass_storage.migrations',
     ],
     install_requires=[
         'XBlock',
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+The tests run the block in the stand-in runtime of the benchmarks, over a SQLite database of their own.
+Run them from the repository root, with XBlock, Django and pytest installed:
+
+    python -m pytest tests
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+os.environ.setdefault('MASTERCLASS_BENCHMARK_DB', os.path.join(tempfile.mkdtemp(), 'masterclass-tests.sqlite3'))
+
+import django  # noqa: E402
+
+django.setup()
+
+from benchmarks.runtime import install_stand_ins  # noqa: E402
+
+install_stand_ins()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+The course-wide registration index agrees with the blocks it indexes.
+"""
+
+import json
+
+import pytest
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from benchmarks.run import STAFF_ID, create_database
+from benchmarks.runtime import BlockHarness
+from masterclass.registrations import APPROVED
+
+STUDENTS = 10
+
+
+@pytest.fixture
+def students():
+    cache.clear()
+    return create_database(STUDENTS)
+
+
+@pytest.fixture(params=['fields', 'database'])
+def backend(request):
+    with override_settings(MASTERCLASS_REGISTRATION_BACKEND=request.param):
+        yield request.param
+
+
+def dashboard(harness):
+    response = harness.handle(STAFF_ID, 'course_dashboard', {}, role='staff')
+    return json.loads(response.body.decode('utf8'))['blocks']
+
+
+def test_a_studio_save_before_the_block_is_indexed_leaves_nothing_out(students, backend):
+    harness = BlockHarness(name=backend)
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "10"}, role='staff')
+    for student in students[:5]:
+        harness.handle(student, 'register_button', {})
+
+    with override_settings(MASTERCLASS_COURSE_INDEX=True):
+        harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "8"}, role='staff')
+        assert dashboard(harness) == []
+        harness.view(STAFF_ID, role='staff')
+        harness.handle(students[5], 'register_button', {})
+
+        blocks = dashboard(harness)
+    assert len(blocks) == 1
+    assert blocks[0][APPROVED] == 6
+    assert blocks[0]['capacity'] == 8
+    assert blocks[0]['display_name'] != u""
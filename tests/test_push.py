@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Pages waiting on the updates handler hear of every change as soon as it's saved, and nothing else.
+"""
+
+import json
+import threading
+import time
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import override_settings
+
+from benchmarks.run import STAFF_ID, create_database
+from benchmarks.runtime import BlockHarness
+
+STUDENTS = 5
+TIMEOUT = 2
+
+
+@pytest.fixture
+def students():
+    cache.clear()
+    return create_database(STUDENTS)
+
+
+@pytest.fixture(params=['fields', 'database'])
+def backend(request):
+    with override_settings(MASTERCLASS_REGISTRATION_BACKEND=request.param, MASTERCLASS_PUSH=True,
+                           MASTERCLASS_PUSH_TIMEOUT=TIMEOUT):
+        yield request.param
+
+
+def updates(harness, student, after=None):
+    query = u"" if after is None else u"after={0}".format(after)
+    response = harness.handle(student, 'updates', method='GET', query=query)
+    return json.loads(response.body.decode('utf8'))
+
+
+def waiting(harness, student, after):
+    """Start waiting for updates in another thread, the way a page does, and return what it will have heard."""
+    heard = {}
+
+    def wait():
+        try:
+            start = time.time()
+            heard.update(updates(harness, student, after))
+            heard['waited'] = time.time() - start
+        finally:
+            connection.close()
+    thread = threading.Thread(target=wait)
+    thread.start()
+    # Long enough for it to be waiting by the time anything happens.
+    time.sleep(0.3)
+    return thread, heard
+
+
+def test_a_registration_reaches_whoever_is_waiting(students, backend):
+    harness = BlockHarness(name=backend, capacity=1)
+    seq = updates(harness, students[1])['seq']
+    thread, heard = waiting(harness, students[1], seq)
+
+    harness.handle(students[0], 'register_button', {})
+    thread.join()
+
+    assert heard['seq'] != seq
+    assert heard['waited'] < TIMEOUT
+    assert heard['status']['free_places'] == 0
+    assert heard['status']['button_text'] == u"Встать в очередь"
+
+
+def test_a_studio_save_reaches_whoever_is_waiting(students, backend):
+    harness = BlockHarness(name=backend)
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "3"}, role='staff')
+    seq = updates(harness, students[0])['seq']
+    thread, heard = waiting(harness, students[0], seq)
+
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "4"}, role='staff')
+    thread.join()
+
+    assert heard['status']['capacity'] == 4
+
+
+def test_without_changes_the_wait_ends_with_nothing_to_tell(students, backend):
+    harness = BlockHarness(name=backend, capacity=1)
+    seq = updates(harness, students[0])['seq']
+
+    start = time.time()
+    heard = updates(harness, students[0], seq)
+
+    assert time.time() - start >= TIMEOUT
+    assert heard == {'seq': seq}
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Registrations under contention: nobody who clicked gets lost, and no more places go than there are.
+
+Only the database backend can take requests to one block at once: the List fields are read whole
+and written back whole by every request, so concurrent ones overwrite each other, which is what the database
+backend is there for. The rest holds for both.
+"""
+
+import json
+from multiprocessing.pool import ThreadPool
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import override_settings
+from webob import Request
+
+from benchmarks.run import STAFF_ID, create_database
+from benchmarks.runtime import BlockHarness
+from masterclass.packing import pack
+from masterclass.registrations import APPROVED, CANCELLED, PENDING, STATES, WAITLISTED
+from masterclass_storage.models import MasterclassRegistration, MasterclassSeats
+
+STUDENTS = 60
+CAPACITY = 20
+WORKERS = 16
+
+
+@pytest.fixture
+def students():
+    cache.clear()
+    return create_database(STUDENTS)
+
+
+@pytest.fixture(params=['fields', 'database'])
+def backend(request):
+    with override_settings(MASTERCLASS_REGISTRATION_BACKEND=request.param):
+        yield request.param
+
+
+@pytest.fixture
+def database_backend():
+    with override_settings(MASTERCLASS_REGISTRATION_BACKEND='database'):
+        yield
+
+
+def in_parallel(function, arguments):
+    """`function` of each of `arguments`, all at once, in as many threads as there are workers."""
+    def call(argument):
+        try:
+            return function(argument)
+        finally:
+            # Every thread has a connection of its own.
+            connection.close()
+    pool = ThreadPool(WORKERS)
+    try:
+        return pool.map(call, arguments)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def click(harness, student):
+    response = harness.handle(student, 'register_button', {'button_clicked': "True"})
+    return json.loads(response.body.decode('utf8'))
+
+
+def registered(harness):
+    """Everyone's registrations, checked for being in one state at a time, and for the seats adding up."""
+    block = harness.block(STAFF_ID, role='staff')
+    registrations = block.registrations
+    lists = dict((state, list(registrations.students(state))) for state in STATES)
+    everyone = [student for students in lists.values() for student in students]
+    assert len(everyone) == len(set(everyone))
+    assert registrations.count(APPROVED) == len(lists[APPROVED])
+    if block.uses_database_registrations():
+        assert MasterclassRegistration.objects.filter(block_id=harness.usage_id, state=APPROVED).count() == \
+            len(lists[APPROVED])
+    return lists
+
+
+def test_everyone_registering_at_once_is_neither_lost_nor_overbooked(students, database_backend):
+    harness = BlockHarness(name=u"database", capacity=CAPACITY)
+    in_parallel(lambda student: click(harness, student), students)
+
+    lists = registered(harness)
+    assert len(lists[APPROVED]) == CAPACITY
+    assert sorted(lists[APPROVED] + lists[WAITLISTED]) == students
+
+
+def test_approving_overlapping_lists_at_once_fills_each_place_once(students, database_backend):
+    harness = BlockHarness(name=u"database", capacity=CAPACITY, approval_required=True)
+    in_parallel(lambda student: click(harness, student), students)
+    assert sorted(registered(harness)[PENDING]) == students
+
+    # Every staff member approves the same students, some of them twice over, one as a string, as JSON can have it.
+    batches = [students[start:start + 30] + [students[start], str(students[start + 1])]
+               for start in range(0, STUDENTS - 30, 3)]
+    in_parallel(lambda batch: harness.handle(STAFF_ID, 'bulk_approval', {'student_ids': batch}, role='staff'),
+                batches)
+
+    lists = registered(harness)
+    assert len(lists[APPROVED]) == CAPACITY
+    assert sorted(lists[APPROVED] + lists[PENDING]) == students
+
+
+def test_approving_one_by_one_at_once_turns_down_whoever_is_too_late(students, database_backend):
+    harness = BlockHarness(name=u"database", capacity=CAPACITY, approval_required=True)
+    in_parallel(lambda student: click(harness, student), students)
+
+    results = in_parallel(lambda student: json.loads(harness.handle(
+        STAFF_ID, 'approval_button', {'student_id': student}, role='staff').body.decode('utf8')), students)
+
+    assert len([result for result in results if result['status'] == "ok"]) == CAPACITY
+    assert all(result['free_places'] >= 0 for result in results)
+    lists = registered(harness)
+    assert len(lists[APPROVED]) == CAPACITY
+    assert sorted(lists[APPROVED] + lists[PENDING]) == students
+
+
+def test_places_given_up_at_once_go_to_the_head_of_the_waitlist(students, database_backend):
+    harness = BlockHarness(name=u"database", capacity=CAPACITY)
+    for student in students:
+        click(harness, student)
+    lists = registered(harness)
+    leaving, line = lists[APPROVED], lists[WAITLISTED]
+
+    in_parallel(lambda student: click(harness, student), leaving)
+
+    lists = registered(harness)
+    assert sorted(lists[APPROVED]) == sorted(line[:CAPACITY])
+    assert lists[WAITLISTED] == line[CAPACITY:]
+    assert sorted(lists[CANCELLED]) == sorted(leaving)
+
+
+def test_a_student_given_twice_takes_one_place(students, backend):
+    harness = BlockHarness(name=backend, capacity=CAPACITY, approval_required=True)
+    for student in students[:3]:
+        click(harness, student)
+
+    response = harness.handle(STAFF_ID, 'bulk_approval', {'student_ids': [students[0], students[0],
+                                                                          str(students[0]), students[1]]},
+                              role='staff')
+
+    result = json.loads(response.body.decode('utf8'))
+    assert result['student_ids'] == students[:2]
+    assert result['free_places'] == CAPACITY - 2
+    lists = registered(harness)
+    assert sorted(lists[APPROVED]) == students[:2]
+    assert lists[PENDING] == students[2:3]
+
+
+def test_cancelling_promotes_the_head_of_the_waitlist(students, backend):
+    harness = BlockHarness(name=backend, capacity=2)
+    for student in students[:5]:
+        click(harness, student)
+
+    click(harness, students[0])
+
+    lists = registered(harness)
+    assert sorted(lists[APPROVED]) == [students[1], students[2]]
+    assert lists[WAITLISTED] == students[3:5]
+    assert lists[CANCELLED] == [students[0]]
+
+
+def test_places_added_in_studio_go_to_the_waitlist(students, backend):
+    harness = BlockHarness(name=backend)
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "2"}, role='staff')
+    for student in students[:5]:
+        click(harness, student)
+
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "4"}, role='staff')
+    # Nobody is registered in Studio, but the next look at the block in the LMS does it.
+    assert registered(harness)[WAITLISTED] == students[2:5]
+    harness.view(students[-1])
+
+    lists = registered(harness)
+    assert sorted(lists[APPROVED]) == students[:4]
+    assert lists[WAITLISTED] == students[4:5]
+
+
+def test_a_capacity_that_is_not_a_number_is_turned_down(students, backend):
+    harness = BlockHarness(name=backend)
+    harness.handle(STAFF_ID, 'save_masterclass', {'capacity': "2"}, role='staff')
+
+    for capacity in ("many", "-1", None):
+        response = harness.handle(STAFF_ID, 'save_masterclass', {'capacity': capacity}, role='staff')
+        assert json.loads(response.body.decode('utf8'))['status'] == "fail"
+    assert harness.block(STAFF_ID, role='staff').capacity == 2
+
+
+def test_approving_with_no_place_free_is_turned_down(students, backend):
+    harness = BlockHarness(name=backend, capacity=1, approval_required=True)
+    for student in students[:2]:
+        click(harness, student)
+    harness.handle(STAFF_ID, 'approval_button', {'student_id': students[0]}, role='staff')
+
+    response = harness.handle(STAFF_ID, 'approval_button', {'student_id': students[1]}, role='staff')
+
+    assert response.status_int == 200
+    assert json.loads(response.body.decode('utf8')) == {'status': "fail", 'student_id': students[1], 'capacity': 1,
+                                                        'free_places': 0}
+    assert registered(harness)[PENDING] == [students[1]]
+
+
+def test_studio_leaves_the_tables_to_be_seeded_from_the_lms(students, database_backend):
+    harness = BlockHarness(name=u"database", capacity=5)
+    block = harness.block(STAFF_ID, role='staff')
+    block.packed_registrations = pack({APPROVED: students[:3]})
+    block.save()
+    # Studio doesn't see what the LMS keeps in the block's user_state_summary.
+    studio = BlockHarness(name=u"database")
+
+    studio.view(STAFF_ID, 'author_view', role='staff')
+    studio.handle(STAFF_ID, 'save_masterclass', {'capacity': "6"}, role='staff')
+    assert not MasterclassSeats.objects.filter(block_id=harness.usage_id).exists()
+
+    harness.view(students[-1])
+    assert sorted(registered(harness)[APPROVED]) == students[:3]
+
+
+def test_importing_a_roster_reports_every_row_that_was_not_registered(students, backend):
+    harness = BlockHarness(name=backend, capacity=3)
+    click(harness, students[0])
+    block = harness.block(STAFF_ID, role='staff')
+    request = Request.blank(u"/", method='POST', content_type='application/json', body=json.dumps(
+        [u"user{0}".format(students[0]), u"nobody", u"user{0}@example.com".format(students[1]),
+         u"user{0}".format(students[1]), u"user{0}".format(students[2]), u"user{0}".format(students[3])]
+    ).encode('utf8'))
+
+    result = json.loads(block.runtime.handle(block, 'import_roster', request).body.decode('utf8'))
+
+    assert result['registered'] == 2
+    assert result['free_places'] == 0
+    assert result['rows'] == [
+        {'row': 1, 'student': u"user{0}".format(students[0]), 'result': "already_registered"},
+        {'row': 2, 'student': u"nobody", 'result': "not_found"},
+        {'row': 4, 'student': u"user{0}".format(students[1]), 'result': "duplicate"},
+        {'row': 6, 'student': u"user{0}".format(students[3]), 'result': "no_places"},
+    ]
+    assert sorted(registered(harness)[APPROVED]) == students[:3]